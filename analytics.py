@@ -0,0 +1,183 @@
+# analytics.py
+
+"""
+This module is the "Statistician". It turns finished quizzes into numbers we can
+ask about: how hard each question is, how long people take on it, and every
+player's personal bests.
+
+Work is done in batches and kept off the quiz path:
+    record()     - called from show_final_score, only appends rows to an in-memory buffer
+    flush()      - writes the buffered rows into the staging tables in one transaction
+    aggregate()  - folds the staged rows into the summary tables with a few GROUP BY
+                   upserts, then empties the staging tables
+The /stats command reads the summary tables only, never the raw rows.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from result_store import STATUS_CODES
+
+ANALYTICS_BACKEND = os.environ.get("ANALYTICS_STORE", "sqlite")  # 'sqlite' or 'off'
+ANALYTICS_DB_PATH = os.environ.get("ANALYTICS_DB_PATH", "analytics.db")
+# Buffered answers are flushed once there are this many, and by the periodic job otherwise
+ANALYTICS_BATCH_SIZE = int(os.environ.get("ANALYTICS_BATCH_SIZE", "500"))
+# How often buffered answers are flushed and staged rows aggregated (seconds)
+ANALYTICS_INTERVAL = float(os.environ.get("ANALYTICS_INTERVAL", "60"))
+
+# Upper bounds (seconds) of the answer time buckets; a last bucket holds everything slower
+TIME_BUCKETS = (2, 5, 10)
+
+_CORRECT, _WRONG, _TIMED_OUT = STATUS_CODES['correct'], STATUS_CODES['wrong'], STATUS_CODES['timed_out']
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS answer_staging ("
+    " set_id TEXT NOT NULL, bank_version TEXT NOT NULL, question_index INTEGER NOT NULL,"
+    " status INTEGER NOT NULL, time_taken REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS play_staging ("
+    " user_id INTEGER NOT NULL, set_id TEXT NOT NULL, total_score INTEGER NOT NULL,"
+    " correct INTEGER NOT NULL, questions INTEGER NOT NULL, finished_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS question_stats ("
+    " set_id TEXT NOT NULL, bank_version TEXT NOT NULL, question_index INTEGER NOT NULL,"
+    " attempts INTEGER NOT NULL, correct INTEGER NOT NULL, wrong INTEGER NOT NULL, timed_out INTEGER NOT NULL,"
+    " answer_time REAL NOT NULL, time_0 INTEGER NOT NULL, time_1 INTEGER NOT NULL, time_2 INTEGER NOT NULL,"
+    " time_3 INTEGER NOT NULL, PRIMARY KEY (set_id, bank_version, question_index))",
+    "CREATE TABLE IF NOT EXISTS user_stats ("
+    " user_id INTEGER NOT NULL, set_id TEXT NOT NULL, plays INTEGER NOT NULL, best_score INTEGER NOT NULL,"
+    " total_score INTEGER NOT NULL, best_correct INTEGER NOT NULL, last_played REAL NOT NULL,"
+    " PRIMARY KEY (user_id, set_id))",
+)
+
+# One pass over the staged answers per aggregation. A question counts as attempted when it was answered
+# or ran out of time; stopped and skipped ones say nothing about its difficulty and are left out.
+# Answer times only count answered questions, and each answer falls into exactly one time bucket.
+_AGGREGATE_QUESTIONS = f"""
+    INSERT INTO question_stats
+    SELECT set_id, bank_version, question_index, COUNT(*),
+           SUM(status = {_CORRECT}), SUM(status = {_WRONG}), SUM(status = {_TIMED_OUT}),
+           SUM(CASE WHEN status IN ({_CORRECT}, {_WRONG}) THEN time_taken ELSE 0 END),
+           SUM(status IN ({_CORRECT}, {_WRONG}) AND time_taken < {TIME_BUCKETS[0]}),
+           SUM(status IN ({_CORRECT}, {_WRONG}) AND time_taken >= {TIME_BUCKETS[0]} AND time_taken < {TIME_BUCKETS[1]}),
+           SUM(status IN ({_CORRECT}, {_WRONG}) AND time_taken >= {TIME_BUCKETS[1]} AND time_taken < {TIME_BUCKETS[2]}),
+           SUM(status IN ({_CORRECT}, {_WRONG}) AND time_taken >= {TIME_BUCKETS[2]})
+    FROM answer_staging WHERE status IN ({_CORRECT}, {_WRONG}, {_TIMED_OUT}) GROUP BY set_id, bank_version, question_index
+    ON CONFLICT (set_id, bank_version, question_index) DO UPDATE SET
+        attempts = attempts + excluded.attempts, correct = correct + excluded.correct,
+        wrong = wrong + excluded.wrong, timed_out = timed_out + excluded.timed_out,
+        answer_time = answer_time + excluded.answer_time, time_0 = time_0 + excluded.time_0,
+        time_1 = time_1 + excluded.time_1, time_2 = time_2 + excluded.time_2, time_3 = time_3 + excluded.time_3
+"""
+
+_AGGREGATE_USERS = """
+    INSERT INTO user_stats
+    SELECT user_id, set_id, COUNT(*), MAX(total_score), SUM(total_score), MAX(correct), MAX(finished_at)
+    FROM play_staging WHERE 1 GROUP BY user_id, set_id
+    ON CONFLICT (user_id, set_id) DO UPDATE SET
+        plays = plays + excluded.plays, best_score = MAX(best_score, excluded.best_score),
+        total_score = total_score + excluded.total_score, best_correct = MAX(best_correct, excluded.best_correct),
+        last_played = MAX(last_played, excluded.last_played)
+"""
+
+class Analytics:
+    """Write-behind analytics over a local SQLite file. All disk work happens in a worker thread."""
+
+    def __init__(self, path: str, batch_size: int):
+        self.batch_size = batch_size
+        self._answers = []  # buffered answer_staging rows
+        self._plays = []    # buffered play_staging rows
+        self._flushing = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+            self._db.commit()
+
+    def record(self, user_id: int, set_id: str, bank_version: str, outcomes, total_score: int):
+        """Buffers one player's finished quiz. Never touches the disk itself."""
+        self._answers.extend(
+            (set_id, bank_version, question_index, status, time_taken)
+            for question_index, status, time_taken in zip(outcomes.question_index, outcomes.status, outcomes.time_taken)
+        )
+        self._plays.append((user_id, set_id, total_score, outcomes.count('correct'), len(outcomes), time.time()))
+        if len(self._answers) >= self.batch_size and self._flushing is None:
+            self._flushing = asyncio.get_running_loop().create_task(self.flush())
+
+    def _insert(self, answers, plays):
+        with self._lock:
+            with self._db:  # one transaction for the whole batch
+                self._db.executemany("INSERT INTO answer_staging VALUES (?, ?, ?, ?, ?)", answers)
+                self._db.executemany("INSERT INTO play_staging VALUES (?, ?, ?, ?, ?, ?)", plays)
+
+    async def flush(self) -> int:
+        """Writes the buffered rows to the staging tables and returns how many plays were written."""
+        answers, plays = self._answers, self._plays
+        self._answers, self._plays = [], []
+        try:
+            if plays:
+                await asyncio.to_thread(self._insert, answers, plays)
+            return len(plays)
+        except sqlite3.Error as e:
+            # Keep the rows for the next attempt rather than losing them
+            logging.error(f"Failed to flush {len(plays)} plays to analytics: {e}")
+            self._answers[:0], self._plays[:0] = answers, plays
+            return 0
+        finally:
+            if self._flushing is asyncio.current_task():
+                self._flushing = None
+
+    def _aggregate(self):
+        with self._lock:
+            with self._db:
+                self._db.execute(_AGGREGATE_QUESTIONS)
+                self._db.execute(_AGGREGATE_USERS)
+                staged = self._db.execute("DELETE FROM play_staging").rowcount
+                self._db.execute("DELETE FROM answer_staging")
+        return staged
+
+    async def aggregate(self) -> int:
+        """Folds the staged rows into the summary tables and returns how many plays that covered."""
+        return await asyncio.to_thread(self._aggregate)
+
+    def _question_stats(self, set_id, bank_version):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT question_index, attempts, correct, wrong, timed_out, answer_time, time_0, time_1, time_2, time_3"
+                " FROM question_stats WHERE set_id = ? AND bank_version = ?", (set_id, bank_version),
+            ).fetchall()
+        return [{'question_index': row[0], 'attempts': row[1], 'correct': row[2], 'wrong': row[3], 'timed_out': row[4],
+                 'answer_time': row[5], 'time_buckets': row[6:]} for row in rows]
+
+    async def question_stats(self, set_id: str, bank_version: str) -> list:
+        """Per-question totals for one version of a set, as dicts."""
+        return await asyncio.to_thread(self._question_stats, set_id, bank_version)
+
+    def _user_stats(self, user_id):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT set_id, plays, best_score, total_score, best_correct, last_played FROM user_stats"
+                " WHERE user_id = ? ORDER BY last_played DESC", (user_id,),
+            ).fetchall()
+        return [{'set_id': row[0], 'plays': row[1], 'best_score': row[2], 'total_score': row[3],
+                 'best_correct': row[4], 'last_played': row[5]} for row in rows]
+
+    async def user_stats(self, user_id: int) -> list:
+        """One player's history per set, most recently played first."""
+        return await asyncio.to_thread(self._user_stats, user_id)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def create_analytics():
+    """Picks the backend from the ANALYTICS_STORE environment variable; None when it is 'off'."""
+    if ANALYTICS_BACKEND == "off":
+        return None
+    return Analytics(ANALYTICS_DB_PATH, ANALYTICS_BATCH_SIZE)
+
+ANALYTICS = create_analytics()
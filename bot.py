@@ -1,16 +1,38 @@
-import logging
 import os
-import json
+
+def require_token() -> str:
+    """The bot token from the TOKEN environment variable."""
+    token = os.getenv("TOKEN")
+    if not token:
+        raise ValueError("TOKEN environment variable not set! Please set it in Render's environment variables.")
+    return token
+
+# A misconfigured instance should fail at once, not after importing the whole telegram stack below
+if __name__ == '__main__':
+    require_token()
+
+import logging
+import time
 import asyncio
+import httpx
 from html import escape
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.error import BadRequest
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, PollHandler, PollAnswerHandler, ContextTypes, JobQueue
+from telegram.error import BadRequest, Forbidden
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, PollHandler, PollAnswerHandler, ContextTypes, JobQueue, TypeHandler
+from telegram.request import HTTPXRequest
 
 # Import our custom modules
-from quiz_manager import get_quiz_set, get_all_sets
-from play_quiz import QuizSession
-from user_quiz_data import format_detailed_review
+from quiz_manager import get_quiz_set, get_all_sets, invalidate_cache, cache_stats, preload_quiz_sets, close_supabase, QUIZ_REFRESH_INTERVAL
+from play_quiz import QuizSession, GroupQuizSession, restore_session
+from timeout_engine import TIMEOUTS
+from user_quiz_data import ReviewPages, get_cached_review, cache_review
+from result_store import RESULT_STORE
+from analytics import ANALYTICS, ANALYTICS_INTERVAL, TIME_BUCKETS
+from send_scheduler import SENDER, PRIORITY_MESSAGE
+from update_processor import PerChatUpdateProcessor
+from session_store import SESSION_STORE
+from sharding import owns_chat, UpdateForwarder, serve_updates, WORKER_URLS, WORKER_PORT, WORKER_INDEX, WORKER_COUNT
+from metrics import METRICS_ENABLED, METRICS_PORT, HANDLER_LATENCY, instrument_request, register_collector, serve_metrics, timed
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,11 +40,35 @@ logger = logging.getLogger(__name__)
 # This dictionary will hold active quiz sessions, with chat_id as the key.
 ACTIVE_SESSIONS = {}
 
+# --- Serving Settings ---
+# Set WEBHOOK_URL (the public https address of this service) to receive updates by webhook instead of polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+PORT = int(os.getenv("PORT", "8443"))
+# Point the bot at another Bot API server, e.g. a local fake one for testing ("http://127.0.0.1:8081/bot")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "256"))
+# "standalone" (default) does everything in one process. To spread chats over several processes, run
+# one "router" (receives updates from Telegram) and WORKER_COUNT "worker"s (play the quizzes), all
+# sharing a SESSION_STORE=sqlite database.
+BOT_ROLE = os.getenv("BOT_ROLE", "standalone")
+
+# --- Session Housekeeping ---
+# Sessions with no activity for this long are evicted, along with finished and suspended ones
+IDLE_SESSION_TTL = float(os.getenv("IDLE_SESSION_TTL", "600"))
+# Sessions using more than this many bytes (bank not included) are logged by the reaper
+SESSION_MEMORY_BUDGET = int(os.getenv("SESSION_MEMORY_BUDGET", str(16 * 1024)))
+
+# Telegram user ids allowed to run admin commands, e.g. ADMIN_IDS="12345,67890"
+ADMIN_IDS = {int(uid) for uid in os.getenv("ADMIN_IDS", "").split(",") if uid.strip()}
+
+@timed(HANDLER_LATENCY, 'start_command')
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles the /start command by showing a menu of available quizzes."""
-    quiz_sets = get_all_sets() # This will now talk to our smart cache manager
+    quiz_sets = await get_all_sets() # This will now talk to our smart cache manager
     if not quiz_sets:
-        await update.message.reply_text("Sorry, no quizzes are available at the moment. Please check back later.")
+        await SENDER.send_message(context.bot, update.effective_chat.id, "Sorry, no quizzes are available at the moment. Please check back later.")
         return
 
     keyboard = []
@@ -37,57 +83,111 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if row:
         keyboard.append(row)
     
-    message_entity = update.message or update.callback_query.message
-    await message_entity.reply_text(
+    await SENDER.send_message(
+        context.bot, update.effective_chat.id,
         "🎲 Welcome to the Quiz Bot! 🎲\n\nPlease select a quiz to start:",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
+async def show_review_page(context: ContextTypes.DEFAULT_TYPE, chat_id: int, session_id: str, page: int, message_id: int = None) -> None:
+    """Sends (or, with message_id, edits in place) one page of a quiz's detailed review."""
+    review = get_cached_review(session_id)
+    if review is None:
+        stored_data = await RESULT_STORE.load(session_id)
+        # Results only reference questions by index, so the bank must be the exact version that was played
+        bank = await get_quiz_set(stored_data['set_id']) if stored_data else None
+        if not bank or bank.version != stored_data['bank_version']:
+            await SENDER.send_message(context.bot, chat_id, "⚠️ The data for this quiz has expired and is no longer available.")
+            return
+        # For a large set, load just the questions that were played
+        bank = bank.for_session(stored_data['outcomes'].question_index)
+        await bank.load_all()
+        # Ask the "Artist" for the review; it renders pages only as they are opened
+        review = cache_review(session_id, ReviewPages(stored_data['outcomes'], stored_data['quiz_name'], bank))
+
+    page, text, has_previous, has_next = review.page(page)
+    buttons = []
+    if has_previous: buttons.append(InlineKeyboardButton("◀️ Prev", callback_data=f'review_page:{session_id}:{page - 1}'))
+    if has_next: buttons.append(InlineKeyboardButton("Next ▶️", callback_data=f'review_page:{session_id}:{page + 1}'))
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+
+    if message_id:
+        try: await SENDER.edit_message_text(context.bot, chat_id, message_id, text, priority=PRIORITY_MESSAGE, parse_mode='HTML', reply_markup=reply_markup)
+        except BadRequest: pass  # "message is not modified" when the same page is opened twice
+    else:
+        await SENDER.send_message(context.bot, chat_id, text, parse_mode='HTML', reply_markup=reply_markup)
+
+@timed(HANDLER_LATENCY, 'button_callback')
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles all button clicks and directs them to the correct action."""
     query = update.callback_query
-    await query.answer()
     data = query.data.split(':', 1)
     action = data[0]
     chat_id = update.effective_chat.id
 
+    if action == 'group_review':
+        # Each player's review goes to their private chat; the answer to the click says where it went
+        user_id = query.from_user.id
+        result_key = f"{data[1]}:{user_id}"
+        if get_cached_review(result_key) is None and await RESULT_STORE.load(result_key) is None:
+            await query.answer("There's no result of yours for this quiz.", show_alert=True)
+            return
+        try:
+            await show_review_page(context, user_id, result_key, 0)
+        except Forbidden:
+            await query.answer("Please start a private chat with me first, then tap again.", show_alert=True)
+            return
+        await query.answer("📬 Your detailed review is in our private chat.")
+        return
+
+    if action in ('start_quiz', 'try_again'):
+        # Anyone in a group can tap an old menu; that mustn't replace the quiz everyone is playing
+        running = ACTIVE_SESSIONS.get(chat_id)
+        if running and running.is_group and not (running.is_finished or running.is_suspended):
+            await query.answer("A quiz is already running in this group.", show_alert=True)
+            return
+
+    await query.answer()
+
     if action == 'start_quiz' or action == 'try_again':
         set_id = data[1]
-        quiz_data = get_quiz_set(set_id) # This talks to our smart cache manager
-        if not quiz_data:
-            await query.message.reply_text("<b>Error:</b> Requested quiz bank not available.", parse_mode='HTML')
+        bank = await get_quiz_set(set_id) # This talks to our smart cache manager
+        if not bank:
+            await SENDER.send_message(context.bot, chat_id, "<b>Error:</b> Requested quiz bank not available.", parse_mode='HTML')
             return
 
         # Clean up previous messages
         if action == 'try_again':
-            try: await query.message.delete()
+            try: await SENDER.delete_message(context.bot, chat_id, query.message.message_id)
             except BadRequest: pass
-            await context.bot.send_message(chat_id, text=f"🚀 Getting the '<b>{escape(quiz_data['name'])}</b>' quiz ready...", parse_mode='HTML')
+            await SENDER.send_message(context.bot, chat_id, f"🚀 Getting the '<b>{escape(bank.name)}</b>' quiz ready...", parse_mode='HTML')
         else:
-            await query.edit_message_text(text=f"🚀 Getting the '<b>{escape(quiz_data['name'])}</b>' quiz ready...", parse_mode='HTML')
+            await SENDER.edit_message_text(context.bot, chat_id, query.message.message_id, f"🚀 Getting the '<b>{escape(bank.name)}</b>' quiz ready...", priority=PRIORITY_MESSAGE, parse_mode='HTML')
 
-        # Create and start a new game session
-        session = QuizSession(context, chat_id, set_id, quiz_data)
+        # Create and start a new game session; in groups everyone plays the same polls
+        if update.effective_chat.type in ('group', 'supergroup'):
+            session = GroupQuizSession(context.bot, context.bot_data, chat_id, set_id, bank, host_id=query.from_user.id)
+        else:
+            session = QuizSession(context.bot, context.bot_data, chat_id, set_id, bank)
+        # A replaced session must not keep its poll, timers and leaderboard running
+        previous = ACTIVE_SESSIONS.get(chat_id)
+        if previous:
+            previous.close()
         ACTIVE_SESSIONS[chat_id] = session
         await session.start()
     
     elif action == 'detailed_review':
-        session_id = data[1]
-        try:
-            with open(f"results/{session_id}.json", "r") as f:
-                stored_data = json.load(f)
-        except FileNotFoundError:
-            await context.bot.send_message(chat_id, "⚠️ The data for this quiz has expired and is no longer available.")
-            return
+        # The first page goes out as a new message; the ◀️/▶️ buttons then edit that same message
+        await show_review_page(context, chat_id, data[1], 0)
 
-        # Ask the "Artist" to format the review
-        message_chunks = format_detailed_review(stored_data['results'], stored_data['quiz_name'], stored_data['questions_data'])
-        for chunk in message_chunks:
-            await context.bot.send_message(chat_id, text=chunk, parse_mode='HTML')
-            await asyncio.sleep(0.5)
+    elif action == 'review_page':
+        session_id, page = data[1].rsplit(':', 1)
+        await show_review_page(context, chat_id, session_id, int(page), message_id=query.message.message_id)
 
     elif action in ['postpone_question', 'skip_permanently', 'stop_quiz']:
         session = ACTIVE_SESSIONS.get(chat_id)
+        if session and session.is_group and query.from_user.id != session.host_id:
+            return
         if session and session.active_poll_id:
             poll_id_to_close = session.active_poll_id
             stopped = (action == 'stop_quiz')
@@ -97,6 +197,157 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             if stopped:
                 ACTIVE_SESSIONS.pop(chat_id, None)
 
+async def reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin only: /reload [set_id] drops cached quiz data after it was edited in Supabase."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    set_id = context.args[0] if context.args else None
+    invalidate_cache(set_id)
+    target = f"'<b>{escape(set_id)}</b>'" if set_id else "all quiz sets"
+    await update.message.reply_text(f"♻️ Cache cleared for {target}. Fresh data will be loaded on next use.", parse_mode='HTML')
+
+async def cache_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin only: /cachestats shows how well the quiz cache is doing."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    lines = []
+    for name, stats in cache_stats().items():
+        lines.append(
+            f"<b>{name}</b>: {stats['entries']} entries, {stats['bytes'] // 1024} KiB\n"
+            f"    hits {stats['hits']} ║ stale {stats['stale_hits']} ║ misses {stats['misses']} ║ "
+            f"evictions {stats['evictions']} ║ hit ratio {stats['hit_ratio']:.0%}"
+        )
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/stats shows your personal bests; /stats <set_id> shows how players do on that quiz."""
+    if not ANALYTICS:
+        return
+    chat_id = update.effective_chat.id
+    if context.args:
+        text = await quiz_stats_text(context.args[0])
+    else:
+        text = await user_stats_text(update.effective_user.id)
+    await SENDER.send_message(context.bot, chat_id, text, parse_mode='HTML')
+
+async def user_stats_text(user_id: int) -> str:
+    history = await ANALYTICS.user_stats(user_id)
+    if not history:
+        return "📈 You haven't finished a quiz yet. (Stats are updated every few minutes.)"
+    names = await get_all_sets()
+    lines = ["📈 <b>𝐘𝐎𝐔𝐑 𝐒𝐓𝐀𝐓𝐒</b>\n"]
+    for entry in history[:10]:
+        name = names.get(entry['set_id'], {}).get('name', entry['set_id'])
+        lines.append(
+            f"<b>{escape(name)}</b>\n"
+            f"    played {entry['plays']}× ║ best <code>{entry['best_score']}</code> ║ "
+            f"avg <code>{entry['total_score'] // entry['plays']}</code> ║ most correct {entry['best_correct']}"
+        )
+    return "\n".join(lines)
+
+async def quiz_stats_text(set_id: str) -> str:
+    bank = await get_quiz_set(set_id)
+    if not bank:
+        return "<b>Error:</b> Requested quiz bank not available."
+    stats = await ANALYTICS.question_stats(set_id, bank.version)
+    if not stats:
+        return f"📊 Nobody has finished '<b>{escape(bank.name)}</b>' yet. (Stats are updated every few minutes.)"
+    attempts = sum(q['attempts'] for q in stats)
+    correct = sum(q['correct'] for q in stats)
+    answered = sum(q['correct'] + q['wrong'] for q in stats)
+    timed_out = sum(q['timed_out'] for q in stats)
+    buckets = [sum(q['time_buckets'][i] for q in stats) for i in range(len(TIME_BUCKETS) + 1)]
+    bounds = [f"<{TIME_BUCKETS[0]}s"] + [f"{low}–{high}s" for low, high in zip(TIME_BUCKETS, TIME_BUCKETS[1:])] + [f"≥{TIME_BUCKETS[-1]}s"]
+    lines = [
+        f"📊 <b>𝐐𝐔𝐈𝐙 𝐒𝐓𝐀𝐓𝐒 » {escape(bank.name)}</b>\n",
+        f"    Answers      »  <code>{answered}</code>",
+        f"    Correct      »  <code>{correct / max(1, answered):.0%}</code>  of answers",
+        f"    Timed out    »  <code>{timed_out / max(1, attempts):.0%}</code>  of questions shown",
+        f"    Avg. time    »  <code>{sum(q['answer_time'] for q in stats) / max(1, answered):.1f}s</code>",
+        "    Time taken   »  " + " ║ ".join(f"{bound} {count / max(1, answered):.0%}" for bound, count in zip(bounds, buckets)),
+        "\n<b>Hardest questions</b>",
+    ]
+    # Accuracy over actual answers, so a question people let run out isn't mistaken for a hard one
+    accuracy = lambda q: q['correct'] / (q['correct'] + q['wrong'])
+    hardest = sorted((q for q in stats if q['correct'] + q['wrong']), key=accuracy)[:5]
+    # For a large set, load just these questions
+    bank = bank.for_session([q['question_index'] for q in hardest])
+    await bank.load_all()
+    for q in hardest:
+        try: text = bank[q['question_index']].text
+        except KeyError: text = "(question removed)"
+        if len(text) > 60: text = text[:57] + "..."
+        lines.append(f"    <code>{accuracy(q):>4.0%}</code>  {escape(text)}")
+    return "\n".join(lines)
+
+async def analytics_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Periodically writes buffered results to the analytics store and updates the stats tables."""
+    await ANALYTICS.flush()
+    plays = await ANALYTICS.aggregate()
+    if plays:
+        logger.info(f"Aggregated {plays} finished quizzes into the stats tables.")
+
+async def on_shutdown(application: Application) -> None:
+    """Makes sure buffered analytics aren't lost when the process stops, and closes the Supabase connections."""
+    if ANALYTICS:
+        await ANALYTICS.flush()
+        await ANALYTICS.aggregate()
+    close_supabase()
+
+async def refresh_quiz_sets_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Periodically brings the local quiz snapshot and the caches up to date with Supabase."""
+    await preload_quiz_sets()
+
+async def purge_results_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Periodically deletes stored results older than the retention period."""
+    removed = await RESULT_STORE.purge_expired()
+    if removed:
+        logger.info(f"Purged {removed} expired quiz results.")
+
+async def reap_sessions_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Evicts finished, suspended and idle sessions from ACTIVE_SESSIONS, and poll entries in
+    bot_data that no live session is waiting on any more.
+    """
+    now = time.time()
+    evicted = 0
+    for chat_id, session in list(ACTIVE_SESSIONS.items()):
+        idle = now - session.last_activity > IDLE_SESSION_TTL
+        if session.is_finished or session.is_suspended or idle:
+            del ACTIVE_SESSIONS[chat_id]
+            session.close()
+            if idle:
+                await session.discard()
+            evicted += 1
+        elif session.memory_footprint() > SESSION_MEMORY_BUDGET:
+            logger.warning(f"Session for chat {chat_id} uses {session.memory_footprint()} bytes, over the {SESSION_MEMORY_BUDGET} byte budget.")
+
+    orphaned = 0
+    for poll_id, quiz_info in list(context.bot_data.items()):
+        session = quiz_info.get('session') if isinstance(quiz_info, dict) else None
+        if session is None:
+            continue
+        if ACTIVE_SESSIONS.get(session.chat_id) is not session or session.active_poll_id != poll_id:
+            del context.bot_data[poll_id]
+            TIMEOUTS.cancel(poll_id)
+            orphaned += 1
+    if evicted or orphaned:
+        logger.info(f"Reaper evicted {evicted} sessions and {orphaned} orphaned polls; {len(ACTIVE_SESSIONS)} sessions active.")
+
+async def session_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin only: /sessions shows how many sessions are live and how much memory they use."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    footprints = [session.memory_footprint() for session in ACTIVE_SESSIONS.values()]
+    total = sum(footprints)
+    average = total // len(footprints) if footprints else 0
+    await update.message.reply_text(
+        f"🎮 <b>Active sessions:</b> {len(footprints)}\n"
+        f"    memory {total // 1024} KiB ║ avg {average} B ║ max {max(footprints, default=0)} B ║ budget {SESSION_MEMORY_BUDGET} B",
+        parse_mode='HTML'
+    )
+
+@timed(HANDLER_LATENCY, 'poll_answer_handler')
 async def poll_answer_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Passes poll answers to the correct game session."""
     poll_id = update.poll_answer.poll_id
@@ -105,27 +356,172 @@ async def poll_answer_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         if session:
             await session.handle_answer(update)
             # If the quiz is over after this answer, remove the session
-            if not getattr(session, 'questions_queue', True) and not getattr(session, 'is_suspended', False):
+            if session.is_finished:
                 ACTIVE_SESSIONS.pop(session.chat_id, None)
 
-def main() -> None:
-    """Initializes and runs the bot with the reliable JobQueue."""
-    TOKEN = os.getenv("TOKEN")
-    if not TOKEN:
-        raise ValueError("TOKEN environment variable not set! Please set it in Render's environment variables.")
-    
-    # Initialize the JobQueue for our internal timers
+# Strong references to tasks started from post_init, which runs before the Application has started
+# (so application.create_task() would warn and not track them)
+_BACKGROUND_TASKS = set()
+
+def run_in_background(coroutine) -> asyncio.Task:
+    task = asyncio.create_task(coroutine)
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_finish_background_task)
+    return task
+
+def _finish_background_task(task: asyncio.Task) -> None:
+    _BACKGROUND_TASKS.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task failed.", exc_info=task.exception())
+
+async def resume_sessions(application: Application) -> None:
+    """Picks up the quizzes this process owns that were still running when it last stopped."""
+    for state in await SESSION_STORE.load_all():
+        chat_id = state['chat_id']
+        if not owns_chat(chat_id) or chat_id in ACTIVE_SESSIONS:
+            continue
+        bank = await get_quiz_set(state['set_id'])
+        if not bank or bank.version != state['bank_version']:
+            logger.warning(f"Dropping saved session for chat {chat_id}: quiz '{state['set_id']}' changed or is gone.")
+            await SESSION_STORE.delete(chat_id)
+            continue
+        session = restore_session(application.bot, application.bot_data, state, bank)
+        ACTIVE_SESSIONS[chat_id] = session
+        run_in_background(session.resume())
+
+def collect_gauges() -> list:
+    """Point-in-time numbers for the metrics endpoint, read only when it is scraped."""
+    caches = cache_stats()
+    sender = SENDER.stats()
+    return [
+        ("quizbot_active_sessions", "Quiz sessions held in memory.", len(ACTIVE_SESSIONS)),
+        ("quizbot_cache_hit_ratio", "Share of cache lookups answered from the cache.",
+         {('cache', name): stats['hit_ratio'] for name, stats in caches.items()}),
+        ("quizbot_cache_entries", "Entries held in each cache.", {('cache', name): stats['entries'] for name, stats in caches.items()}),
+        ("quizbot_cache_bytes", "Estimated bytes held in each cache.", {('cache', name): stats['bytes'] for name, stats in caches.items()}),
+        ("quizbot_send_queued_chats", "Chats with sends waiting in the scheduler.", sender['queued_chats']),
+        ("quizbot_send_flood_waits", "Sends the scheduler had to retry after a 429, since start.", sender['flood_waits']),
+        ("quizbot_timers_armed", "Question timeouts currently armed.", TIMEOUTS.stats()['armed']),
+    ]
+
+async def start_metrics(application: Application) -> None:
+    """Starts the /metrics endpoint when METRICS_ENABLED is set."""
+    if not METRICS_ENABLED or 'metrics_server' in application.bot_data:
+        return
+    register_collector(collect_gauges)
+    application.bot_data['metrics_server'] = await serve_metrics(port=METRICS_PORT)
+    logger.info(f"Serving metrics on port {METRICS_PORT}.")
+
+async def on_startup(application: Application) -> None:
+    await start_metrics(application)
+    # Quiz sets are preloaded in the background; until then they come from the local snapshot or on demand
+    run_in_background(preload_quiz_sets())
+    await resume_sessions(application)
+
+async def run_worker(application: Application) -> None:
+    """Runs a shard worker: it doesn't poll Telegram, the router pushes this shard's updates to it."""
+    async with application:
+        await application.start()
+        await on_startup(application)
+        server = await serve_updates(application, port=WORKER_PORT)
+        print(f"Worker {WORKER_INDEX + 1}/{WORKER_COUNT} is waiting for updates on port {WORKER_PORT}...")
+        try:
+            await server.serve_forever()
+        finally:
+            server.close()
+            await application.stop()
+            await on_shutdown(application)
+
+def build_application(token: str, role: str = BOT_ROLE, request=None) -> Application:
+    """
+    Builds the Application for the given role with all handlers and jobs registered.
+    `request` replaces the HTTP layer for Bot API calls (the load test passes a fake one).
+    """
+    if role in ("router", "worker") and not SESSION_STORE.shared:
+        # The router finds which worker owns a poll through the session store; with one only this process
+        # can read, group answers would silently go to the wrong worker
+        raise ValueError(f"BOT_ROLE={role} needs a session store shared by all processes. Set SESSION_STORE=sqlite.")
+    def update_chat_key(update: Update):
+        """Which chat an update belongs to, so updates of one chat are handled in order."""
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.poll_answer:
+            # Poll answers carry no chat, but the poll belongs to a session that knows it
+            quiz_info = application.bot_data.get(update.poll_answer.poll_id)
+            if quiz_info:
+                # A group's answers are scored concurrently, the session guards its own state
+                session = quiz_info['session']
+                return None if session.is_group else session.chat_id
+            return update.poll_answer.user.id if update.poll_answer.user else None
+        return None
+
+    # Initialize the JobQueue for housekeeping jobs (question timeouts run on the TimeoutEngine)
     job_queue = JobQueue()
-    application = Application.builder().token(TOKEN).job_queue(job_queue).build()
+    builder = Application.builder().token(token).job_queue(job_queue)
+    if role == "worker" or request is not None:
+        builder.updater(None)
+    if METRICS_ENABLED:
+        # Time every Bot API call; 256 connections is what PTB would use by default
+        request = instrument_request(request or HTTPXRequest(connection_pool_size=256))
+    if request is not None:
+        builder.request(request)
+    if role == "router":
+        forwarder = UpdateForwarder(WORKER_URLS, SESSION_STORE)
+        async def close_forwarder(_: Application) -> None:
+            await forwarder.close()
+        builder.post_shutdown(close_forwarder)
+        builder.post_init(start_metrics)
+    else:
+        builder.post_init(on_startup)
+        builder.post_shutdown(on_shutdown)
+    # Updates run concurrently, but each chat's updates still run one at a time and in order
+    builder.concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES, update_chat_key))
+    if TELEGRAM_API_URL:
+        builder.base_url(TELEGRAM_API_URL)
+    application = builder.build()
     
-    # Register all the necessary handlers
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CallbackQueryHandler(button_callback))
-    application.add_handler(PollAnswerHandler(poll_answer_handler))
-    # We no longer need PollHandler for timeouts, as it's handled internally
-
-    print("Bot is running with Smart Cache and reliable inactivity detection...")
-    application.run_polling()
+    if role == "router":
+        # The router plays no quizzes itself, it only hands every update to the worker owning the chat
+        async def forward_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            try: await forwarder.forward(update)
+            except httpx.HTTPError as e: logger.error(f"Failed to forward update {update.update_id}: {e}")
+        application.add_handler(TypeHandler(Update, forward_update))
+    else:
+        # Register all the necessary handlers
+        application.add_handler(CommandHandler("start", start_command))
+        application.add_handler(CommandHandler("reload", reload_command))
+        application.add_handler(CommandHandler("cachestats", cache_stats_command))
+        application.add_handler(CommandHandler("sessions", session_stats_command))
+        application.add_handler(CommandHandler("stats", stats_command))
+        application.add_handler(CallbackQueryHandler(button_callback))
+        application.add_handler(PollAnswerHandler(poll_answer_handler))
+        # We no longer need PollHandler for timeouts, as it's handled internally
+
+        # Expired results are cleaned up hourly
+        job_queue.run_repeating(purge_results_job, interval=3600, first=60)
+        # Idle, finished and suspended sessions are evicted every minute
+        job_queue.run_repeating(reap_sessions_job, interval=60, first=60)
+        # Quiz sets edited in Supabase are picked up by this refresh
+        job_queue.run_repeating(refresh_quiz_sets_job, interval=QUIZ_REFRESH_INTERVAL, first=QUIZ_REFRESH_INTERVAL)
+        # Finished quizzes reach the /stats tables in batches
+        if ANALYTICS:
+            job_queue.run_repeating(analytics_job, interval=ANALYTICS_INTERVAL, first=ANALYTICS_INTERVAL)
+    return application
+
+def main() -> None:
+    """Initializes and runs the bot with the reliable JobQueue."""
+    application = build_application(require_token())
+    if BOT_ROLE == "worker":
+        asyncio.run(run_worker(application))
+    elif WEBHOOK_URL:
+        print(f"Bot is running in webhook mode on port {PORT}...")
+        application.run_webhook(
+            listen="0.0.0.0", port=PORT, url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        print("Bot is running with Smart Cache and reliable inactivity detection...")
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,346 @@
+# fake_services.py
+
+"""
+This module is the "Stunt Double". It provides in-process stand-ins for the two
+services the bot talks to, so the whole quiz flow can run locally without network:
+
+- FakeBotAPI plugs into python-telegram-bot as its request layer and answers
+  Bot API calls (sendPoll, sendMessage, ...) with realistic JSON.
+- FakeSupabase mimics the small part of the supabase-py query builder we use,
+  backed by plain lists of dicts.
+- FakePostgrest serves those same tables over HTTP like PostgREST does, so the
+  real supabase client (and its connection pool) can be pointed at it.
+
+Used by load_test.py and startup_bench.py.
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Quiz Bot", "username": "fake_quiz_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+FLOODED_METHODS = frozenset({'sendMessage', 'sendPoll', 'editMessageText', 'deleteMessage'})
+
+def chat_dict(chat_id: int) -> dict:
+    if chat_id > 0:
+        return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+    return {"id": chat_id, "type": "supergroup", "title": f"Group {chat_id}"}
+
+def user_dict(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+class FakeBotAPI(BaseRequest):
+    """
+    A Bot API server living inside the process. `latency` (seconds) is added to every call.
+    With `flood_rate` > 0, that fraction of message calls (send/edit/delete, the ones Telegram
+    rate limits per chat) is answered with a 429 "retry after".
+    `listener(method, params, result)` is called for every successful call.
+    """
+
+    def __init__(self, latency: float = 0.0, flood_rate: float = 0.0, listener=None):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.listener = listener
+        self.calls = Counter()               # method -> count
+        self.calls_by_chat = defaultdict(int)  # chat_id -> count
+        self.floods = 0
+        self._message_ids = itertools.count(1)
+        self._poll_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.flood_rate and api_method in FLOODED_METHODS and random.random() < self.flood_rate:
+            self.floods += 1
+            body = {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1", "parameters": {"retry_after": 1}}
+            return 429, json.dumps(body).encode()
+
+        handler = getattr(self, f"_api_{api_method}", None)
+        result = handler(params) if handler else True
+        self.calls[api_method] += 1
+        chat_id = params.get('chat_id')
+        if chat_id is not None:
+            self.calls_by_chat[int(chat_id)] += 1
+        if self.listener:
+            self.listener(api_method, params, result)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def _message(self, chat_id, **fields) -> dict:
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": chat_dict(int(chat_id)), "from": BOT_USER}
+        message.update(fields)
+        return message
+
+    def _api_getMe(self, params):
+        return BOT_USER
+
+    def _api_getUpdates(self, params):
+        return []
+
+    def _api_sendMessage(self, params):
+        fields = {"text": params.get('text', '')}
+        if 'reply_markup' in params:
+            fields['reply_markup'] = params['reply_markup']
+        return self._message(params['chat_id'], **fields)
+
+    def _api_editMessageText(self, params):
+        fields = {"text": params.get('text', ''), "message_id": params['message_id'], "edit_date": int(time.time())}
+        if 'reply_markup' in params:
+            fields['reply_markup'] = params['reply_markup']
+        message = self._message(params['chat_id'])
+        message.update(fields)
+        return message
+
+    def _api_sendPoll(self, params):
+        options = []
+        for i, option in enumerate(params.get('options', [])):
+            text = option['text'] if isinstance(option, dict) else option
+            options.append({"text": text, "voter_count": 0, "persistent_id": str(i)})
+        poll = {
+            "id": str(next(self._poll_ids)), "question": params['question'], "options": options,
+            "total_voter_count": 0, "is_closed": False, "is_anonymous": params.get('is_anonymous', True),
+            "type": params.get('type', 'regular'), "allows_multiple_answers": False, "allows_revoting": False, "members_only": False,
+            "open_period": params.get('open_period'),
+        }
+        # Newer Bot API versions send a list of correct options instead of a single id
+        correct = params.get('correct_option_ids', params.get('correct_option_id'))
+        if isinstance(correct, str):
+            correct = json.loads(correct)
+        if isinstance(correct, list):
+            poll["correct_option_ids"] = correct
+            poll["correct_option_id"] = correct[0] if correct else None
+        elif correct is not None:
+            poll["correct_option_id"] = correct
+        return self._message(params['chat_id'], poll=poll)
+
+# --- Updates, as Telegram would deliver them ---
+
+_update_ids = itertools.count(1)
+
+def command_update(chat_id: int, user_id: int, command: str) -> dict:
+    return {"update_id": next(_update_ids), "message": {
+        "message_id": 0, "date": int(time.time()), "chat": chat_dict(chat_id), "from": user_dict(user_id),
+        "text": command, "entities": [{"type": "bot_command", "offset": 0, "length": len(command.split()[0])}],
+    }}
+
+def callback_update(chat_id: int, user_id: int, data: str, message: dict) -> dict:
+    return {"update_id": next(_update_ids), "callback_query": {
+        "id": str(next(_update_ids)), "from": user_dict(user_id), "chat_instance": str(chat_id),
+        "data": data, "message": message,
+    }}
+
+def poll_answer_update(poll_id: str, user_id: int, option_id: int) -> dict:
+    return {"update_id": next(_update_ids), "poll_answer": {
+        "poll_id": poll_id, "user": user_dict(user_id), "option_ids": [option_id],
+        "option_persistent_ids": [str(option_id)],
+    }}
+
+class _FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+class _FakeQuery:
+    """Chainable query over one fake table, mimicking postgrest's builder."""
+
+    def __init__(self, client, table: str):
+        self._client = client
+        self._table = table
+        self._columns = None
+        self._filters = []
+        self._order = None
+        self._range = None
+        self._single = False
+        self._count = None
+        self._insert = None
+
+    def select(self, *columns, count=None):
+        if columns and columns != ('*',):
+            self._columns = [c.strip() for column in columns for c in column.split(',')]
+        self._count = count
+        return self
+
+    def eq(self, column, value):
+        self._filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self._filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def gt(self, column, value):
+        self._filters.append(lambda row: row.get(column) is not None and row.get(column) > value)
+        return self
+
+    def order(self, column, desc=False):
+        self._order = (column, desc)
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def limit(self, n):
+        self._range = (0, n - 1)
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def insert(self, rows):
+        self._insert = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def execute(self):
+        if self._client.latency:
+            time.sleep(self._client.latency)  # the real client blocks too
+        self._client.queries += 1
+        table = self._client.tables.setdefault(self._table, [])
+
+        if self._insert is not None:
+            table.extend(dict(row) for row in self._insert)
+            return _FakeResponse(self._insert)
+
+        rows = [row for row in table if all(f(row) for f in self._filters)]
+        count = len(rows) if self._count else None
+        if self._order:
+            column, desc = self._order
+            rows.sort(key=lambda row: row.get(column), reverse=desc)
+        if self._range:
+            rows = rows[self._range[0]:self._range[1] + 1]
+        if self._columns:
+            rows = [{c: row.get(c) for c in self._columns} for row in rows]
+        if self._single:
+            if len(rows) != 1:
+                raise Exception("PGRST116: JSON object requested, multiple (or no) rows returned")
+            return _FakeResponse(rows[0], count)
+        return _FakeResponse(rows, count)
+
+class FakeSupabase:
+    """Stand-in for a supabase Client: `tables` maps table names to lists of row dicts."""
+
+    def __init__(self, tables: dict, latency: float = 0.0):
+        self.tables = tables
+        self.latency = latency
+        self.queries = 0
+
+    def table(self, name: str) -> _FakeQuery:
+        return _FakeQuery(self, name)
+
+def _text_filter(column: str, values: set):
+    # Everything arrives as text in a URL, so compare as text
+    return lambda row: row.get(column) is not None and str(row.get(column)) in values
+
+class _PostgrestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as with the real thing
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = self.server.supabase.table(url.path.rstrip('/').rsplit('/', 1)[-1])
+        for name, value in parse_qsl(url.query, keep_blank_values=True):
+            if name == 'select':
+                if value != '*':
+                    query.select(*value.split(','))
+            elif name == 'limit':
+                query.limit(int(value))
+            elif value.startswith('eq.'):
+                query._filters.append(_text_filter(name, {value[3:]}))
+            elif value.startswith('in.('):
+                query._filters.append(_text_filter(name, {v.strip('"') for v in value[4:-1].split(',')}))
+            elif value.startswith('gt.'):
+                query._filters.append(lambda row, name=name, bound=value[3:]: row.get(name) is not None and str(row.get(name)) > bound)
+        counted = 'count=exact' in self.headers.get('Prefer', '')
+        query._count = 'exact' if counted else None
+        if 'vnd.pgrst.object' in self.headers.get('Accept', ''):
+            query.single()
+
+        headers = {"Content-Type": "application/json"}
+        try:
+            response = query.execute()
+            status, payload = 200, response.data
+            if counted:
+                headers["Content-Range"] = f"0-{max(0, len(response.data or []) - 1)}/{response.count}"
+        except Exception as e:
+            status, payload = 406, {"code": "PGRST116", "message": str(e), "details": None, "hint": None}
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakePostgrest:
+    """
+    A PostgREST-like HTTP server on 127.0.0.1 for `tables` (select=, eq./in./gt. filters, limit,
+    single-object and counted responses). Point the real client at `url`. Queries are counted
+    and delayed by `latency` through the FakeSupabase behind it.
+    """
+
+    def __init__(self, tables: dict, latency: float = 0.0):
+        self.supabase = FakeSupabase(tables, latency=latency)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _PostgrestHandler)
+        self.server.daemon_threads = True
+        self.server.supabase = self.supabase
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def make_row_quiz_tables(sets: int, questions_per_set: int, sample_size: int, options: int = 4):
+    """
+    Builds a `quizzes` table of large sets (no 'questions' JSON, just a 'sample_size') and the
+    `questions` table holding their questions as rows. Returns (quizzes rows, questions rows).
+    """
+    quizzes, questions = [], []
+    for s in range(sets):
+        quizzes.append({"set_id": f"set{s}", "name": f"Load Test Bank {s}", "questions": None,
+                        "sample_size": sample_size, "updated_at": "2026-01-01T00:00:00+00:00"})
+        questions.extend(
+            {"set_id": f"set{s}", "position": q, "id": q, "question": f"Set {s} row question {q}: which option is right?",
+             "options": [f"Option {o}" for o in range(options)], "correct_option_id": random.randrange(options)}
+            for q in range(questions_per_set)
+        )
+    return quizzes, questions
+
+def make_quizzes_table(sets: int, questions_per_set: int, options: int = 4) -> list:
+    """Builds rows for the `quizzes` table: set_id, name, updated_at and a 'questions' JSON list."""
+    rows = []
+    for s in range(sets):
+        questions = [
+            {"id": q, "question": f"Set {s} question {q}: which option is right?",
+             "options": [f"Option {o}" for o in range(options)], "correct_option_id": random.randrange(options)}
+            for q in range(questions_per_set)
+        ]
+        rows.append({"set_id": f"set{s}", "name": f"Load Test Quiz {s}", "questions": questions,
+                     "updated_at": "2026-01-01T00:00:00+00:00"})
+    return rows
@@ -0,0 +1,56 @@
+# leaderboard.py
+
+"""
+This module is the "Scoreboard" for group quizzes. Scores are kept in order all the
+time: when a player's score changes, only that player's entry is moved (found with
+bisect), instead of re-sorting everyone on every answer.
+"""
+
+from bisect import bisect_left, insort
+from html import escape
+from itertools import count
+
+MEDALS = ("🥇", "🥈", "🥉")
+
+class Leaderboard:
+    """
+    Players ordered by score. `keys` is a sorted list of (-score, seq, user_id): the highest
+    score comes first, and between equal scores whoever reached it first ranks higher.
+    """
+    __slots__ = ('keys', 'key_of', '_seq')
+
+    def __init__(self):
+        self.keys = []
+        self.key_of = {}  # user_id -> current key in `keys`
+        self._seq = count()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def update(self, user_id: int, score: int):
+        """Sets a player's score, adding them if they're new. O(log n) search plus one list shift."""
+        old = self.key_of.get(user_id)
+        if old is not None:
+            if -old[0] == score:
+                return
+            del self.keys[bisect_left(self.keys, old)]
+        key = (-score, next(self._seq), user_id)
+        insort(self.keys, key)
+        self.key_of[user_id] = key
+
+    def top(self, n: int) -> list:
+        """The best `n` players as (user_id, score)."""
+        return [(user_id, -neg_score) for neg_score, _, user_id in self.keys[:n]]
+
+    def rank(self, user_id: int):
+        """A player's 1-based position, or None if they haven't scored yet."""
+        key = self.key_of.get(user_id)
+        return None if key is None else bisect_left(self.keys, key) + 1
+
+    def render(self, names: dict, n: int = 10) -> str:
+        """HTML lines for the top `n`, with `names` mapping user_id -> display name."""
+        lines = []
+        for position, (user_id, score) in enumerate(self.top(n), 1):
+            badge = MEDALS[position - 1] if position <= len(MEDALS) else f"{position}."
+            lines.append(f"{badge} {escape(names.get(user_id, str(user_id)))}  »  <code>{score}</code>")
+        return "\n".join(lines) if lines else "<i>No answers yet.</i>"
@@ -0,0 +1,237 @@
+# load_test.py
+
+"""
+This module is the "Stress Test". It runs the real bot (bot.py, play_quiz.py, ...)
+against the fakes in fake_services.py and simulates many users playing at once:
+
+    /start -> pick a quiz -> countdown -> answer every poll -> final score -> detailed review
+
+and reports how the process holds up: answer-to-next-poll latency, event-loop lag,
+Bot API calls per quiz and memory per session.
+
+Example:
+    python load_test.py --users 500 --questions 10 --answer-time lognormal:1.0,0.5 --global-rate 100000
+
+Note: Telegram's real global limit (~30 msg/s) is applied by default, which caps how
+fast quizzes can progress. Raise --global-rate to measure what the process itself can do.
+"""
+
+import argparse
+import asyncio
+import gc
+import math
+import os
+import random
+import resource
+import time
+import tracemalloc
+from collections import defaultdict
+
+def parse_distribution(spec: str):
+    """
+    Turns 'fixed:2', 'uniform:1,5', 'exp:3' (mean) or 'lognormal:mu,sigma' into a
+    function returning answer times in seconds.
+    """
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',') if v]
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'exp':
+        return lambda: random.expovariate(1 / values[0])
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown answer time distribution: {spec}")
+
+def percentiles(samples: list, points=(50, 90, 99)) -> str:
+    if not samples:
+        return "no samples"
+    ordered = sorted(samples)
+    parts = [f"p{p}={ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)] * 1000:.1f}ms" for p in points]
+    return " ".join(parts) + f" max={ordered[-1] * 1000:.1f}ms (n={len(ordered)})"
+
+class Simulation:
+    """Drives one Application with simulated users and collects the measurements."""
+
+    def __init__(self, args, application, api):
+        self.args = args
+        self.application = application
+        self.api = api
+        self.answer_time = parse_distribution(args.answer_time)
+        self.events = defaultdict(asyncio.Queue)  # chat_id -> events seen by the fake API
+        self.answer_latencies = []
+        self.review_latencies = []
+        self.loop_lags = []
+        self.completed = 0
+        self.peak_sessions = 0
+        self.footprints = []
+        self.traced_per_session = None
+        api.listener = self.on_api_call
+
+    def on_api_call(self, method, params, result):
+        chat_id = params.get('chat_id')
+        if chat_id is None:
+            return
+        now = time.perf_counter()
+        if method == 'sendPoll':
+            self.events[int(chat_id)].put_nowait(('poll', now, result))
+        elif method == 'sendMessage':
+            self.events[int(chat_id)].put_nowait(('message', now, result))
+        elif method == 'editMessageText':
+            self.events[int(chat_id)].put_nowait(('edit', now, result))
+
+    async def inject(self, update: dict):
+        from telegram import Update
+        await self.application.update_queue.put(Update.de_json(update, self.application.bot))
+
+    async def wait_for(self, chat_id: int, kinds: tuple, predicate=lambda result: True):
+        while True:
+            kind, at, result = await self.events[chat_id].get()
+            if kind in kinds and predicate(result):
+                return kind, at, result
+
+    @staticmethod
+    def button_data(result: dict, prefix: str):
+        for row in (result.get('reply_markup') or {}).get('inline_keyboard', []):
+            for button in row:
+                if button.get('callback_data', '').startswith(prefix):
+                    return button['callback_data']
+        return None
+
+    async def user(self, chat_id: int):
+        from fake_services import command_update, callback_update, poll_answer_update
+        await asyncio.sleep(random.uniform(0, self.args.ramp))
+
+        # /start, then pick a random quiz from the menu
+        await self.inject(command_update(chat_id, chat_id, '/start'))
+        _, _, menu = await self.wait_for(chat_id, ('message',), lambda r: self.button_data(r, 'start_quiz:'))
+        choice = f"start_quiz:set{random.randrange(self.args.sets)}"
+        await self.inject(callback_update(chat_id, chat_id, choice, menu))
+
+        answered_at = None
+        while True:
+            kind, at, result = await self.wait_for(chat_id, ('poll', 'message'), lambda r: 'poll' in r or self.button_data(r, 'detailed_review:'))
+            if answered_at is not None:
+                self.answer_latencies.append(at - answered_at)
+                answered_at = None
+            if kind == 'message':
+                break
+
+            poll = result['poll']
+            if random.random() < self.args.skip_rate:
+                continue  # let it time out
+            await asyncio.sleep(min(self.answer_time(), self.args.max_answer_time))
+            correct = poll['correct_option_id']
+            option = correct if random.random() < self.args.accuracy else (correct + 1) % len(poll['options'])
+            answered_at = time.perf_counter()
+            await self.inject(poll_answer_update(poll['id'], chat_id, option))
+
+        if self.args.review:
+            clicked_at = time.perf_counter()
+            await self.inject(callback_update(chat_id, chat_id, self.button_data(result, 'detailed_review:'), result))
+            _, at, _ = await self.wait_for(chat_id, ('message',), lambda r: '𝐃𝐄𝐓𝐀𝐈𝐋𝐄𝐃' in r.get('text', '') or 'expired' in r.get('text', ''))
+            self.review_latencies.append(at - clicked_at)
+        self.completed += 1
+
+    async def monitor_loop_lag(self, interval: float = 0.01):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lags.append(max(0.0, loop.time() - started - interval))
+
+    async def monitor_sessions(self, sessions: dict):
+        while True:
+            await asyncio.sleep(0.5)
+            if len(sessions) > self.peak_sessions:
+                self.peak_sessions = len(sessions)
+                self.footprints = [s.memory_footprint() for s in sessions.values()]
+                if tracemalloc.is_tracing():
+                    self.traced_per_session = tracemalloc.get_traced_memory()[0] / len(sessions)
+
+async def run(args):
+    # Configure the bot modules before they are imported: keep everything in memory
+    os.environ.setdefault("RESULT_STORE", "memory")
+    os.environ.setdefault("SESSION_STORE", "memory")
+    os.environ.setdefault("QUIZ_SNAPSHOT_PATH", "")
+    os.environ.setdefault("ANALYTICS_DB_PATH", ":memory:")
+    os.environ["SEND_GLOBAL_RATE"] = str(args.global_rate)
+    os.environ["SEND_PRIVATE_CHAT_RATE"] = str(args.chat_rate)
+
+    from fake_services import FakeBotAPI, FakeSupabase, make_quizzes_table, make_row_quiz_tables
+    import quiz_manager
+    import bot
+
+    if args.row_questions:
+        quizzes, questions = make_row_quiz_tables(args.sets, args.row_questions, args.questions)
+        tables = {'quizzes': quizzes, quiz_manager.QUESTIONS_TABLE: questions}
+    else:
+        tables = {'quizzes': make_quizzes_table(args.sets, args.questions)}
+    quiz_manager.supabase = FakeSupabase(tables, latency=args.db_latency)
+    api = FakeBotAPI(latency=args.api_latency, flood_rate=args.flood_rate)
+    application = bot.build_application("123456:LOAD-TEST", role="standalone", request=api)
+    sim = Simulation(args, application, api)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    async with application:
+        await application.start()
+        monitors = [asyncio.create_task(sim.monitor_loop_lag()), asyncio.create_task(sim.monitor_sessions(bot.ACTIVE_SESSIONS))]
+        started = time.perf_counter()
+        users = [asyncio.create_task(sim.user(1_000_000 + u)) for u in range(args.users)]
+        done, pending = await asyncio.wait(users, timeout=args.timeout)
+        elapsed = time.perf_counter() - started
+        for task in list(pending) + monitors:
+            task.cancel()
+        await application.stop()
+
+    gc.collect()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    failed = [t for t in done if t.exception()]
+    total_calls = sum(api.calls.values())
+
+    print(f"\n=== Load test: {args.users} users, {args.questions} questions, answer time {args.answer_time} ===")
+    print(f"Completed quizzes     : {sim.completed}/{args.users} in {elapsed:.1f}s ({len(pending)} unfinished, {len(failed)} failed)")
+    print(f"Answer -> next poll   : {percentiles(sim.answer_latencies)}  (includes the fixed 0.7s pause after an answer)")
+    if args.review:
+        print(f"Review click -> page  : {percentiles(sim.review_latencies)}")
+    print(f"Event loop lag        : {percentiles(sim.loop_lags)}")
+    print(f"Bot API calls         : {total_calls} total, {total_calls / max(1, args.users):.1f} per quiz, {api.floods} answered with 429")
+    print("    by method         : " + ", ".join(f"{m}={n}" for m, n in api.calls.most_common()))
+    print(f"Supabase queries      : {quiz_manager.supabase.queries}")
+    print(f"Peak active sessions  : {sim.peak_sessions}")
+    if sim.footprints:
+        print(f"Session footprint     : avg {sum(sim.footprints) / len(sim.footprints):.0f} B, max {max(sim.footprints)} B (bank excluded)")
+    if sim.traced_per_session is not None:
+        print(f"Traced memory/session : {sim.traced_per_session / 1024:.1f} KiB (everything allocated, divided by peak sessions)")
+    print(f"Max RSS growth        : {(rss_after - rss_before) / 1024:.1f} MiB")
+    for task in failed[:3]:
+        print(f"Failure               : {task.exception()!r}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the quiz bot against fake Telegram and Supabase services.")
+    parser.add_argument("--users", type=int, default=200, help="number of simulated users (one private chat each)")
+    parser.add_argument("--sets", type=int, default=5, help="number of quiz sets in the fake quizzes table")
+    parser.add_argument("--questions", type=int, default=10, help="questions per quiz set")
+    parser.add_argument("--row-questions", type=int, default=0,
+                        help="make the sets large ones with this many questions stored as rows; --questions are sampled per quiz")
+    parser.add_argument("--answer-time", default="lognormal:0.7,0.5", help="fixed:S | uniform:A,B | exp:MEAN | lognormal:MU,SIGMA")
+    parser.add_argument("--max-answer-time", type=float, default=14.0, help="answers never take longer than this")
+    parser.add_argument("--accuracy", type=float, default=0.7, help="chance a user picks the correct option")
+    parser.add_argument("--skip-rate", type=float, default=0.0, help="chance a user lets a question time out")
+    parser.add_argument("--ramp", type=float, default=5.0, help="users start spread over this many seconds")
+    parser.add_argument("--api-latency", type=float, default=0.03, help="seconds added to every Bot API call")
+    parser.add_argument("--db-latency", type=float, default=0.05, help="seconds added to every Supabase query")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="fraction of Bot API calls answered with 429")
+    parser.add_argument("--global-rate", type=float, default=30.0, help="global send limit (messages/s) for the bot's scheduler")
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="per private chat send limit (messages/s)")
+    parser.add_argument("--no-review", dest="review", action="store_false", help="don't open the detailed review")
+    parser.add_argument("--tracemalloc", action="store_true", help="trace allocations for memory per session (slower)")
+    parser.add_argument("--timeout", type=float, default=600.0, help="give up after this many seconds")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+# metrics.py
+
+"""
+This module is the "Dashboard". It counts and times what happens on the hot paths
+(handlers, Supabase fetches, Bot API calls, question timers, result writes) and
+serves it in Prometheus' text format on METRICS_PORT, e.g. http://host:9100/metrics.
+
+It is off unless METRICS_ENABLED is set. When it's off, @timed hands back the
+function it was given and every other hook is a single `if METRICS_ENABLED:`, so
+the bot pays next to nothing for it.
+
+With TRACE_UPDATES set as well, each update is logged as a one-line trace of
+where its time went: waiting for the chat, the handler, Supabase, sends, ...
+"""
+
+import asyncio
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
+TRACE_UPDATES = METRICS_ENABLED and os.environ.get("TRACE_UPDATES", "").lower() in ("1", "true", "yes")
+
+# Seconds; covers everything from a cache hit to a slow Bot API call under flood control
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram:
+    """Counts observations into cumulative buckets, optionally split by labels."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # label values -> [count per bucket (+ overflow), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+# --- The metrics themselves ---
+HANDLER_LATENCY = Histogram("quizbot_handler_seconds", "Time spent in an update handler.", ("handler",))
+SUPABASE_FETCH = Histogram("quizbot_supabase_fetch_seconds", "Time spent on a Supabase query, compiling included.", ("query",))
+BOT_API_LATENCY = Histogram("quizbot_bot_api_seconds", "Bot API call latency.", ("method",))
+BOT_API_FLOODS = Counter("quizbot_bot_api_floods_total", "Bot API calls answered with 429 Too Many Requests.", ("method",))
+TIMER_LAG = Histogram("quizbot_timer_lag_seconds", "How late question timeouts fired.",
+                      buckets=(0.01, 0.05, 0.1, 0.15, 0.2, 0.5, 1.0, 5.0))
+RESULT_WRITE = Histogram("quizbot_result_write_seconds", "Time to store a finished quiz result.", ("store",))
+UPDATE_LATENCY = Histogram("quizbot_update_seconds", "Time from taking an update off the queue to finishing it, waiting for its chat included.")
+
+METRICS = [HANDLER_LATENCY, SUPABASE_FETCH, BOT_API_LATENCY, BOT_API_FLOODS, TIMER_LAG, RESULT_WRITE, UPDATE_LATENCY]
+_COLLECTORS = []  # functions returning [(name, help, {label value tuple: value} or value)] read at scrape time
+
+def register_collector(func):
+    """Adds gauges computed at scrape time, e.g. the number of active sessions. Returns `func`."""
+    _COLLECTORS.append(func)
+    return func
+
+def render() -> str:
+    """Everything in Prometheus' text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for collector in _COLLECTORS:
+        try:
+            for name, help, value in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} gauge")
+                if isinstance(value, dict):
+                    for (label, label_value), v in value.items():
+                        lines.append(f'{name}{{{label}="{label_value}"}} {v}')
+                else:
+                    lines.append(f"{name} {value}")
+        except Exception:
+            logging.exception("A metrics collector failed.")
+    return "\n".join(lines) + "\n"
+
+# --- Per-update traces ---
+
+class Trace:
+    __slots__ = ('spans', 'open')
+
+    def __init__(self):
+        self.spans = []   # (name, seconds)
+        self.open = True  # background tasks may outlive the update; they stop recording once it's done
+
+_CURRENT_TRACE = contextvars.ContextVar("quizbot_trace", default=None)
+
+def _record_span(name: str, seconds: float):
+    trace = _CURRENT_TRACE.get()
+    if trace is not None and trace.open:
+        trace.spans.append((name, seconds))
+
+class span:
+    """`with span("name"):` adds a timed span to the current update's trace (only used when TRACE_UPDATES is on)."""
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record_span(self.name, time.perf_counter() - self.started)
+
+def start_trace() -> Trace:
+    trace = Trace()
+    _CURRENT_TRACE.set(trace)
+    return trace
+
+def finish_trace(trace: Trace, update_id, key, total: float):
+    trace.open = False
+    spans = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in trace.spans)
+    logging.getLogger("trace").info(f"update {update_id} (chat {key}) {total * 1000:.1f}ms: {spans}")
+
+# --- Hooks ---
+
+def timed(histogram: Histogram, *labels, span_name: str = None):
+    """
+    Decorator recording how long each call takes in `histogram` (and as a trace span).
+    Works for plain and async functions. When metrics are off the function is returned untouched.
+    """
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+        name = span_name or func.__name__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    histogram.observe(elapsed, *labels)
+                    if TRACE_UPDATES: _record_span(name, elapsed)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    histogram.observe(elapsed, *labels)
+                    if TRACE_UPDATES: _record_span(name, elapsed)
+        return wrapper
+    return decorator
+
+@functools.lru_cache(maxsize=None)
+def _instrumented_request_class():
+    # Defined on first use: telegram takes a while to import, and tools that only format
+    # results (user_quiz_data.py, via result_store.py) import this module too
+    from telegram.request import BaseRequest
+
+    class InstrumentedRequest(BaseRequest):
+        def __init__(self, inner: BaseRequest):
+            self._inner = inner
+
+        @property
+        def read_timeout(self):
+            return self._inner.read_timeout
+
+        async def initialize(self) -> None:
+            await self._inner.initialize()
+
+        async def shutdown(self) -> None:
+            await self._inner.shutdown()
+
+        async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                             write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                             pool_timeout=BaseRequest.DEFAULT_NONE):
+            api_method = url.rsplit('/', 1)[-1]
+            started = time.perf_counter()
+            status, body = await self._inner.do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+            )
+            BOT_API_LATENCY.observe(time.perf_counter() - started, api_method)
+            if status == 429:
+                BOT_API_FLOODS.inc(api_method)
+            return status, body
+
+    return InstrumentedRequest
+
+def instrument_request(inner):
+    """Wraps the request object the bot uses for Bot API calls to time every call and count 429s."""
+    return _instrumented_request_class()(inner)
+
+# --- The /metrics endpoint ---
+
+async def serve_metrics(host: str = "0.0.0.0", port: int = METRICS_PORT):
+    """A tiny HTTP server answering every GET with the current metrics. Returns the asyncio server."""
+
+    async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # headers don't matter here
+            if request_line.startswith(b"GET "):
+                body = render().encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                    + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+                )
+            else:
+                writer.write(b"HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_connection, host, port)
@@ -1,13 +1,20 @@
 import asyncio
-import time
+import base64
 import os
-import json
-import random
+import sys
+import time
+from collections import deque
 from html import escape
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.error import BadRequest
-from telegram.ext import ContextTypes
 import logging
+from question_bank import QuestionBank, QuestionLoadError
+from leaderboard import Leaderboard
+from result_store import RESULT_STORE, Outcomes
+from analytics import ANALYTICS
+from timeout_engine import TIMEOUTS
+from send_scheduler import SENDER, PRIORITY_COSMETIC
+from session_store import SESSION_STORE
 
 # --- Constants ---
 SECONDS_PER_QUESTION = 15
@@ -15,6 +22,11 @@ POINTS_CORRECT = 100
 POINTS_WRONG_PENALTY = -25
 MAX_SPEED_BONUS = 50
 CONSECUTIVE_TIMEOUT_LIMIT = 5  # <<< NEW: Inactivity limit
+# Group quizzes: the live leaderboard message is edited at most this often (seconds)
+LEADERBOARD_INTERVAL = float(os.getenv("LEADERBOARD_INTERVAL", "10"))
+LEADERBOARD_SIZE = 10
+# Large sets: how long to wait before each new try when a page of questions fails to load (seconds)
+QUESTION_LOAD_RETRY_DELAYS = (1, 3, 10)
 
 # --- Helper Functions ---
 def calculate_points(time_taken):
@@ -22,42 +34,180 @@ def calculate_points(time_taken):
     if time_taken >= SECONDS_PER_QUESTION: return 0
     return int(MAX_SPEED_BONUS * (1 - (time_taken / SECONDS_PER_QUESTION)))
 
-def get_question_by_id_from_data(qid, questions_data):
-    return next((q for q in questions_data if q["id"] == qid), None)
-
 # --- The Game Session Class ---
 class QuizSession:
-    def __init__(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int, set_id: str, quiz_data: dict):
-        self.context = context
+    # Slotted and array-backed, so thousands of sessions stay small. See memory_footprint().
+    __slots__ = (
+        'bot', 'bot_data', 'chat_id', 'set_id', 'quiz_name', 'bank', 'questions_queue', 'postponed',
+        'outcomes', 'total_score', 'active_poll_message_id', 'active_poll_id', 'active_poll_sent_at',
+        'session_id', 'consecutive_timeouts', 'is_suspended', 'is_finished', 'last_activity',
+    )
+    is_group = False
+
+    def __init__(self, bot, bot_data: dict, chat_id: int, set_id: str, bank: QuestionBank):
+        # Only the two things we need from the handler context, not the context itself
+        self.bot = bot
+        self.bot_data = bot_data
         self.chat_id = chat_id
         self.set_id = set_id
-        self.quiz_name = quiz_data['name']
-        self.questions_data = list(quiz_data['questions'])
-        random.shuffle(self.questions_data)
-        self.questions_queue = [q['id'] for q in self.questions_data]
-        self.results = []
+        self.quiz_name = bank.name
+        # A compiled bank is shared with every other session and we only keep our own shuffled order
+        # of indexes; a large set gives us our own sample of it instead (see question_bank.py)
+        self.bank = bank.for_session()
+        self.questions_queue = deque(self.bank.quiz_order())
+        self.postponed = bytearray()  # one bit per question index, grown as questions get postponed
+        self.outcomes = Outcomes()
         self.total_score = 0
         self.active_poll_message_id = None
         self.active_poll_id = None
+        self.active_poll_sent_at = None
         self.session_id = f"{chat_id}_{int(time.time())}"
         self.consecutive_timeouts = 0  # <<< NEW: Inactivity counter
         self.is_suspended = False # Flag to prevent multiple final messages
+        self.is_finished = False
+        self.last_activity = time.time()
+
+    def is_postponed(self, question_index: int) -> bool:
+        byte = question_index >> 3
+        return byte < len(self.postponed) and bool(self.postponed[byte] & (1 << (question_index & 7)))
+
+    def mark_postponed(self, question_index: int):
+        byte = question_index >> 3
+        if byte >= len(self.postponed):
+            self.postponed.extend(bytes(byte + 1 - len(self.postponed)))
+        self.postponed[byte] |= 1 << (question_index & 7)
+
+    def memory_footprint(self) -> int:
+        """Approximate bytes used by this session alone (the shared question bank is not counted)."""
+        return (sys.getsizeof(self) + sys.getsizeof(self.questions_queue) + sys.getsizeof(self.postponed)
+                + sys.getsizeof(self.outcomes) + self.outcomes.nbytes() + sys.getsizeof(self.session_id))
+
+    # --- Saving and restoring (so another process can continue this quiz) ---
+    def to_state(self) -> dict:
+        """Everything needed to rebuild this session, as plain JSON-friendly values."""
+        return {
+            'chat_id': self.chat_id, 'set_id': self.set_id, 'bank_version': self.bank.version,
+            'session_id': self.session_id, 'questions_queue': list(self.questions_queue),
+            'postponed': base64.b64encode(self.postponed).decode(),
+            'outcomes': base64.b64encode(self.outcomes.to_bytes()).decode(), 'total_score': self.total_score,
+            'active_poll_id': self.active_poll_id, 'active_poll_message_id': self.active_poll_message_id,
+            'active_poll_sent_at': self.active_poll_sent_at, 'consecutive_timeouts': self.consecutive_timeouts,
+        }
+
+    @classmethod
+    def from_state(cls, bot, bot_data: dict, state: dict, bank: QuestionBank):
+        """Rebuilds a session saved with to_state(). `bank` must be the version it was saved with."""
+        session = cls(bot, bot_data, state['chat_id'], state['set_id'], bank)
+        session.session_id = state['session_id']
+        session.questions_queue = deque(state['questions_queue'])
+        session.postponed = bytearray(base64.b64decode(state['postponed']))
+        session.outcomes = Outcomes.from_bytes(base64.b64decode(state['outcomes']))
+        session.total_score = state['total_score']
+        session.active_poll_id = state['active_poll_id']
+        session.active_poll_message_id = state['active_poll_message_id']
+        session.active_poll_sent_at = state['active_poll_sent_at']
+        session.consecutive_timeouts = state['consecutive_timeouts']
+        # For a large set, continue with the questions this session had drawn
+        session.bank = bank.for_session(list(session.questions_queue) + list(session.outcomes.question_index))
+        return session
+
+    async def checkpoint(self):
+        """Saves the current state to the session store. A failing store never stops the quiz."""
+        # Serializing the whole session on every poll and answer only pays off if the state leaves the process
+        if not SESSION_STORE.shared: return
+        try: await SESSION_STORE.save(self.chat_id, self.to_state())
+        except Exception as e: logging.error(f"Failed to save session for chat {self.chat_id}: {e}")
+
+    async def discard(self):
+        """Removes this session from the session store once it is over."""
+        if not SESSION_STORE.shared: return
+        try: await SESSION_STORE.delete(self.chat_id)
+        except Exception as e: logging.error(f"Failed to delete session for chat {self.chat_id}: {e}")
+
+    def close(self):
+        """Drops this session's timer and poll bookkeeping, e.g. when the reaper evicts it."""
+        if self.active_poll_id:
+            TIMEOUTS.cancel(self.active_poll_id)
+            self.bot_data.pop(self.active_poll_id, None)
+
+    async def release_poll(self, poll_id: str):
+        """Forgets a finished poll in the session store."""
+        if not SESSION_STORE.shared: return
+        try: await SESSION_STORE.unmap_poll(poll_id)
+        except Exception as e: logging.error(f"Failed to unmap poll {poll_id}: {e}")
+
+    async def fetch_question(self, question_index: int):
+        """
+        The question from the bank, trying again a few times if its page fails to load.
+        None if the question no longer exists; raises QuestionLoadError once the tries run out.
+        """
+        for delay in QUESTION_LOAD_RETRY_DELAYS:
+            try:
+                return await self.bank.fetch(question_index)
+            except QuestionLoadError as e:
+                logging.warning(f"{e}, trying again in {delay}s.")
+                await asyncio.sleep(delay)
+        return await self.bank.fetch(question_index)
+
+    async def resume(self):
+        """Continues a restored session: re-arms the open poll's timer, or sends the next question."""
+        if not self.active_poll_id or not self.questions_queue:
+            await self.send_next_question()
+            return
+        # The open question must be at hand to score the answer
+        try:
+            question = await self.fetch_question(self.questions_queue[0])
+        except QuestionLoadError as e:
+            logging.error(f"Couldn't resume quiz for chat {self.chat_id}: {e}")
+            await self.suspend_quiz("a problem loading its questions")
+            return
+        if question is None:
+            # The open question is gone: close its poll and go on with the next one
+            await self.release_poll(self.active_poll_id)
+            self.active_poll_id = None
+            await self.send_next_question()
+            return
+        self.bot_data[self.active_poll_id] = {"session": self, "question_index": self.questions_queue[0], "time_sent": self.active_poll_sent_at}
+        remaining = self.active_poll_sent_at + SECONDS_PER_QUESTION + 1 - time.time()
+        TIMEOUTS.arm(self.active_poll_id, max(0.0, remaining), self.handle_timeout, self.active_poll_id)
+        logging.info(f"Resumed quiz for chat {self.chat_id} with {len(self.questions_queue)} questions left.")
 
     async def start(self):
+        # The countdown is cosmetic: it yields to polls from other chats, and stale edits get dropped
+        bot = self.bot
+        self.last_activity = time.time()
+        # Large sets: load the first questions while the countdown runs
+        if self.questions_queue:
+            self.bank.prefetch(self.questions_queue[0])
         try:
-            msg = await self.context.bot.send_message(self.chat_id, text="Get Ready... 3️⃣")
-            await asyncio.sleep(1.1); await msg.edit_text("Get Ready... 2️⃣")
-            await asyncio.sleep(1.1); await msg.edit_text("Get Ready... 1️⃣")
-            await asyncio.sleep(1.1); await msg.edit_text("🚦 GO!")
-            await asyncio.sleep(0.5); await msg.delete()
+            msg = await SENDER.send_message(bot, self.chat_id, "Get Ready... 3️⃣", priority=PRIORITY_COSMETIC)
+            await asyncio.sleep(1.1); await SENDER.edit_message_text(bot, self.chat_id, msg.message_id, "Get Ready... 2️⃣")
+            await asyncio.sleep(1.1); await SENDER.edit_message_text(bot, self.chat_id, msg.message_id, "Get Ready... 1️⃣")
+            await asyncio.sleep(1.1); await SENDER.edit_message_text(bot, self.chat_id, msg.message_id, "🚦 GO!")
+            await asyncio.sleep(0.5); await SENDER.delete_message(bot, self.chat_id, msg.message_id, priority=PRIORITY_COSMETIC)
         except BadRequest as e:
             logging.warning(f"Countdown error: {e}")
         await self.send_next_question()
 
     async def send_next_question(self):
+        # Large sets load their questions as the quiz goes; a question whose row is gone is dropped,
+        # but one that can't be loaded right now suspends the quiz instead of ending it
+        question = None
+        while self.questions_queue:
+            try:
+                question = await self.fetch_question(self.questions_queue[0])
+            except QuestionLoadError as e:
+                logging.error(f"Suspending quiz for chat {self.chat_id}: {e}")
+                await self.suspend_quiz("a problem loading its questions")
+                return
+            if question is not None:
+                break
+            logging.error(f"Question {self.questions_queue[0]} of '{self.set_id}' couldn't be loaded, skipping it.")
+            self.questions_queue.popleft()
+
         delete_task = None
         if self.active_poll_message_id:
-            delete_task = self.context.bot.delete_message(self.chat_id, self.active_poll_message_id)
+            delete_task = SENDER.delete_message(self.bot, self.chat_id, self.active_poll_message_id)
         
         if not self.questions_queue:
             if delete_task:
@@ -66,19 +216,14 @@ class QuizSession:
             await self.show_final_score()
             return
 
-        question_id = self.questions_queue[0]
-        question_data = get_question_by_id_from_data(question_id, self.questions_data)
-        total_answered = len(self.results)
-        is_postponed = getattr(self, f"is_postponed_{question_id}", False)
-        
-        keyboard = [[InlineKeyboardButton("⏹️ Stop Quiz", callback_data='stop_quiz')]]
-        if is_postponed: keyboard[0].append(InlineKeyboardButton("⏩ Skip Permanently", callback_data='skip_permanently'))
-        else: keyboard[0].append(InlineKeyboardButton("➡️ Postpone", callback_data='postpone_question'))
+        question_index = self.questions_queue[0]
+        total_answered = len(self.outcomes)
+        total_questions = total_answered + len(self.questions_queue)
 
-        send_task = self.context.bot.send_poll(
-            chat_id=self.chat_id, question=f"Q {total_answered + 1}/{len(self.questions_data)}: {question_data['question']}",
-            options=question_data["options"], type='quiz', correct_option_id=question_data["correct_option_id"],
-            open_period=SECONDS_PER_QUESTION, is_anonymous=False, reply_markup=InlineKeyboardMarkup(keyboard)
+        send_task = SENDER.send_poll(
+            self.bot, self.chat_id, question=f"Q {total_answered + 1}/{total_questions}: {question.text}",
+            options=question.options, type='quiz', correct_option_id=question.correct_option_id,
+            open_period=SECONDS_PER_QUESTION, is_anonymous=False, reply_markup=self.question_keyboard(question_index)
         )
         try:
             if delete_task: _, message = await asyncio.gather(delete_task, send_task)
@@ -89,34 +234,48 @@ class QuizSession:
 
         self.active_poll_message_id = message.message_id
         self.active_poll_id = message.poll.id
-        self.context.bot_data[message.poll.id] = {"session": self, "question_id": question_id, "time_sent": time.time()}
+        self.active_poll_sent_at = self.last_activity = time.time()
+        self.bot_data[message.poll.id] = {"session": self, "question_index": question_index, "time_sent": self.active_poll_sent_at}
         
-        self.context.job_queue.run_once(self.handle_timeout_job, SECONDS_PER_QUESTION + 1, data={'poll_id': message.poll.id}, name=f"timeout_{message.poll.id}")
+        TIMEOUTS.arm(message.poll.id, SECONDS_PER_QUESTION + 1, self.handle_timeout, message.poll.id)
+        # Let other processes route answers to this poll here, and survive a restart
+        if SESSION_STORE.shared:
+            try: await SESSION_STORE.map_poll(message.poll.id, self.chat_id)
+            except Exception as e: logging.error(f"Failed to map poll {message.poll.id}: {e}")
+        await self.checkpoint()
+
+    def question_keyboard(self, question_index: int) -> InlineKeyboardMarkup:
+        keyboard = [[InlineKeyboardButton("⏹️ Stop Quiz", callback_data='stop_quiz')]]
+        if self.is_postponed(question_index): keyboard[0].append(InlineKeyboardButton("⏩ Skip Permanently", callback_data='skip_permanently'))
+        else: keyboard[0].append(InlineKeyboardButton("➡️ Postpone", callback_data='postpone_question'))
+        return InlineKeyboardMarkup(keyboard)
 
     async def handle_answer(self, update: Update):
         poll_id = self.active_poll_id
-        jobs = self.context.job_queue.get_jobs_by_name(f"timeout_{poll_id}")
-        for job in jobs: job.schedule_removal()
+        TIMEOUTS.cancel(poll_id)
 
-        quiz_info = self.context.bot_data.pop(poll_id, None)
+        quiz_info = self.bot_data.pop(poll_id, None)
         if not quiz_info: return
-        
+        self.active_poll_id = None
+        # Scored before anything is awaited, so a slow session store never eats into the speed bonus
+        answer = update.poll_answer; time_taken = time.time() - quiz_info['time_sent']
         self.consecutive_timeouts = 0  # <<< NEW: Reset inactivity counter on answer
 
-        answer = update.poll_answer; time_taken = time.time() - quiz_info['time_sent']
-        question_id = self.questions_queue.pop(0); question_data = get_question_by_id_from_data(question_id, self.questions_data)
-        is_correct = answer.option_ids[0] == question_data["correct_option_id"]
+        question_index = self.questions_queue.popleft(); question = self.bank[question_index]
+        is_correct = answer.option_ids[0] == question.correct_option_id
         points, status = (POINTS_CORRECT + calculate_points(time_taken), 'correct') if is_correct else (POINTS_WRONG_PENALTY, 'wrong')
         
         self.total_score += points
-        self.results.append({'question_id': question_id, 'status': status, 'points_earned': points, 'time_taken': time_taken, 'answered_option_id': answer.option_ids[0]})
+        self.outcomes.append(question_index, status, points, time_taken, answer.option_ids[0])
+        self.last_activity = time.time()
+        await self.release_poll(poll_id)
+        await self.checkpoint()
         
         await asyncio.sleep(0.7)
         await self.send_next_question()
 
-    async def handle_timeout_job(self, context: ContextTypes.DEFAULT_TYPE):
-        job_data = context.job.data; poll_id = job_data['poll_id']
-        if poll_id in self.context.bot_data:
+    async def handle_timeout(self, poll_id: str):
+        if poll_id in self.bot_data:
             logging.info(f"Internal timer job triggered for poll {poll_id}. Processing timeout.")
             
             self.consecutive_timeouts += 1  # <<< NEW: Increment inactivity counter
@@ -129,47 +288,257 @@ class QuizSession:
             logging.info(f"Internal timer job for poll {poll_id} ignored (already answered).")
             
     async def handle_closure(self, poll_id: str, stopped=False, postponed=False, skipped=False):
-        quiz_info = self.context.bot_data.pop(poll_id, None)
+        TIMEOUTS.cancel(poll_id)
+        quiz_info = self.bot_data.pop(poll_id, None)
         if not quiz_info or not self.questions_queue: return
+        self.active_poll_id = None
+        await self.release_poll(poll_id)
 
-        if quiz_info.get("question_id") == self.questions_queue[0]:
-            question_id = self.questions_queue.pop(0); status = 'timed_out'
-            if postponed: self.questions_queue.append(question_id); setattr(self, f"is_postponed_{question_id}", True); status = 'postponed'
+        if quiz_info.get("question_index") == self.questions_queue[0]:
+            question_index = self.questions_queue.popleft(); status = 'timed_out'
+            if postponed: self.questions_queue.append(question_index); self.mark_postponed(question_index); status = 'postponed'
             elif skipped: status = 'skipped'
             elif stopped: status = 'stopped'
             
             if status != 'postponed':
-                self.results.append({'question_id': question_id, 'status': status, 'points_earned': 0, 'time_taken': SECONDS_PER_QUESTION, 'answered_option_id': None})
+                self.outcomes.append(question_index, status, 0, SECONDS_PER_QUESTION)
+            self.last_activity = time.time()
             
             if not self.questions_queue or stopped: await self.show_final_score()
             else: await self.send_next_question()
 
-    async def suspend_quiz(self):
-        """NEW: Stops the quiz due to user inactivity."""
+    async def suspend_quiz(self, reason: str = "inactivity"):
+        """NEW: Stops the quiz due to user inactivity (or, with `reason`, something else)."""
         if self.is_suspended: return
         self.is_suspended = True
+        await self.discard()
         
         # Clean up any active poll and timer
-        if self.active_poll_id in self.context.bot_data: self.context.bot_data.pop(self.active_poll_id)
-        jobs = self.context.job_queue.get_jobs_by_name(f"timeout_{self.active_poll_id}")
-        for job in jobs: job.schedule_removal()
-        try: await self.context.bot.delete_message(self.chat_id, self.active_poll_message_id)
+        if self.active_poll_id in self.bot_data: self.bot_data.pop(self.active_poll_id)
+        TIMEOUTS.cancel(self.active_poll_id)
+        await self.release_poll(self.active_poll_id)
+        try: await SENDER.delete_message(self.bot, self.chat_id, self.active_poll_message_id)
         except BadRequest: pass
 
-        logging.warning(f"Quiz suspended for chat {self.chat_id} due to inactivity.")
+        logging.warning(f"Quiz suspended for chat {self.chat_id} due to {reason}.")
         keyboard = [[InlineKeyboardButton("🔄      Try Again      🔄", callback_data=f'try_again:{self.set_id}')]]
-        await self.context.bot.send_message(
-            self.chat_id,
-            text="⚠️ Quiz session has been suspended due to inactivity.",
+        await SENDER.send_message(
+            self.bot, self.chat_id,
+            f"⚠️ Quiz session has been suspended due to {reason}.",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
     
     async def show_final_score(self):
         if self.is_suspended: return
-        if not os.path.exists('results'): os.makedirs('results')
-        data_to_save = {'results': self.results, 'quiz_name': self.quiz_name, 'questions_data': self.questions_data}
-        with open(f"results/{self.session_id}.json", "w") as f: json.dump(data_to_save, f, indent=2)
-        correct_count = sum(1 for r in self.results if r['status'] == 'correct'); wrong_count = sum(1 for r in self.results if r['status'] == 'wrong')
+        self.is_finished = True
+        await self.discard()
+        # Only the set id, bank version and packed outcomes are saved; the review is rebuilt from the shared bank
+        record = {'outcomes': self.outcomes, 'quiz_name': self.quiz_name, 'set_id': self.set_id, 'bank_version': self.bank.version, 'total_score': self.total_score}
+        try: await RESULT_STORE.save(self.session_id, record)
+        except Exception as e: logging.error(f"Failed to save results for {self.session_id}: {e}")
+        # A private chat's id is the player's user id
+        if ANALYTICS: ANALYTICS.record(self.chat_id, self.set_id, self.bank.version, self.outcomes, self.total_score)
+        correct_count = self.outcomes.count('correct'); wrong_count = self.outcomes.count('wrong')
         score_text = (f"⫷ 🏆 <b>𝐅𝐈𝐍𝐀𝐋 𝐒𝐂𝐎𝐑𝐄 » {escape(self.quiz_name)}</b> 🏆 ⫸\n\n" f"    ✅ Correct       »  <code>{correct_count}</code>\n" f"    ❌ Wrong         »  <code>{wrong_count}</code>\n\n" f"    ✪ <b>Total Points</b>  »  <code>{self.total_score}</code>")
         keyboard = [[InlineKeyboardButton("📊 Detailed Review", callback_data=f'detailed_review:{self.session_id}')], [InlineKeyboardButton("🔄      Try Again      🔄", callback_data=f'try_again:{self.set_id}')]]
-        await self.context.bot.send_message(self.chat_id, text=score_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+        await SENDER.send_message(self.bot, self.chat_id, score_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+
+# --- Group Quizzes ---
+class Participant:
+    """One player of a group quiz: their running score and their own per-question outcomes."""
+    __slots__ = ('name', 'score', 'outcomes')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.score = 0
+        self.outcomes = Outcomes()
+
+class GroupQuizSession(QuizSession):
+    """
+    A quiz played by a whole group chat. Each poll stays open for its full window and every
+    member's answer is scored on arrival (answers of one poll are handled concurrently, so
+    handle_answer never awaits while scoring). The leaderboard is kept sorted as scores change
+    and posted/edited at most every LEADERBOARD_INTERVAL seconds. Every player gets their own
+    result record, saved as "<session_id>:<user_id>", for their private detailed review.
+    """
+    __slots__ = ('host_id', 'participants', 'leaderboard', 'round_answers', 'round_correct',
+                 'leaderboard_message_id', 'leaderboard_due', 'last_flush')
+    is_group = True
+
+    def __init__(self, bot, bot_data: dict, chat_id: int, set_id: str, bank: QuestionBank, host_id: int = None):
+        super().__init__(bot, bot_data, chat_id, set_id, bank)
+        self.host_id = host_id  # only the player who started the quiz can stop it
+        self.participants = {}  # user_id -> Participant
+        self.leaderboard = Leaderboard()
+        self.round_answers = set()  # user_ids who answered the open poll
+        self.round_correct = 0
+        self.leaderboard_message_id = None
+        self.leaderboard_due = False
+        self.last_flush = 0.0
+
+    @property
+    def leaderboard_key(self):
+        return ('leaderboard', self.chat_id)
+
+    def memory_footprint(self) -> int:
+        return (super().memory_footprint() + sys.getsizeof(self.participants) + sys.getsizeof(self.round_answers)
+                + sum(sys.getsizeof(p) + p.outcomes.nbytes() for p in self.participants.values()))
+
+    def to_state(self) -> dict:
+        state = super().to_state()
+        state.update({
+            'mode': 'group', 'host_id': self.host_id, 'round_answers': list(self.round_answers),
+            'round_correct': self.round_correct, 'leaderboard_message_id': self.leaderboard_message_id,
+            'participants': {user_id: [p.name, p.score, base64.b64encode(p.outcomes.to_bytes()).decode()]
+                             for user_id, p in self.participants.items()},
+        })
+        return state
+
+    @classmethod
+    def from_state(cls, bot, bot_data: dict, state: dict, bank: QuestionBank):
+        session = super().from_state(bot, bot_data, state, bank)
+        session.host_id = state['host_id']
+        session.round_answers = set(state['round_answers'])
+        session.round_correct = state['round_correct']
+        session.leaderboard_message_id = state['leaderboard_message_id']
+        for user_id, (name, score, outcomes) in state['participants'].items():
+            participant = Participant(name)
+            participant.score = score
+            participant.outcomes = Outcomes.from_bytes(base64.b64decode(outcomes))
+            session.participants[int(user_id)] = participant  # JSON turned the ids into strings
+            session.leaderboard.update(int(user_id), score)
+        return session
+
+    def close(self):
+        super().close()
+        TIMEOUTS.cancel(self.leaderboard_key)
+
+    def question_keyboard(self, question_index: int) -> InlineKeyboardMarkup:
+        # Nobody postpones or skips for the whole group
+        return InlineKeyboardMarkup([[InlineKeyboardButton("⏹️ Stop Quiz", callback_data='stop_quiz')]])
+
+    async def handle_answer(self, update: Update):
+        answer = update.poll_answer
+        quiz_info = self.bot_data.get(answer.poll_id)
+        # Stale polls, duplicate answers and retracted votes are ignored
+        if not quiz_info or answer.poll_id != self.active_poll_id or not answer.option_ids or answer.user is None:
+            return
+        user = answer.user
+        if user.id in self.round_answers:
+            return
+        self.round_answers.add(user.id)
+
+        participant = self.participants.get(user.id)
+        if participant is None:
+            participant = self.participants[user.id] = Participant(user.full_name)
+        time_taken = time.time() - quiz_info['time_sent']
+        question_index = quiz_info['question_index']
+        is_correct = answer.option_ids[0] == self.bank[question_index].correct_option_id
+        points, status = (POINTS_CORRECT + calculate_points(time_taken), 'correct') if is_correct else (POINTS_WRONG_PENALTY, 'wrong')
+        if is_correct:
+            self.round_correct += 1
+
+        participant.score += points
+        participant.outcomes.append(question_index, status, points, time_taken, answer.option_ids[0])
+        self.leaderboard.update(user.id, participant.score)
+        self.last_activity = time.time()
+        self.schedule_leaderboard()
+
+    async def handle_timeout(self, poll_id: str):
+        if poll_id not in self.bot_data:
+            return
+        # Only a round nobody answered counts towards suspending the quiz
+        if self.round_answers:
+            self.consecutive_timeouts = 0
+        else:
+            self.consecutive_timeouts += 1
+            if self.consecutive_timeouts >= CONSECUTIVE_TIMEOUT_LIMIT:
+                await self.suspend_quiz()
+                return
+        await self.handle_closure(poll_id=poll_id)
+
+    async def handle_closure(self, poll_id: str, stopped=False, postponed=False, skipped=False):
+        if postponed or skipped:
+            return
+        TIMEOUTS.cancel(poll_id)
+        quiz_info = self.bot_data.pop(poll_id, None)
+        if not quiz_info or not self.questions_queue: return
+        self.active_poll_id = None
+        await self.release_poll(poll_id)
+
+        question_index = self.questions_queue.popleft()
+        self.close_round(question_index, 'stopped' if stopped else 'timed_out')
+        self.last_activity = time.time()
+        if not self.questions_queue or stopped: await self.show_final_score()
+        else: await self.send_next_question()
+
+    def close_round(self, question_index: int, status: str):
+        """Records the closed question for players who didn't answer it, and for the session itself."""
+        for user_id, participant in self.participants.items():
+            if user_id not in self.round_answers:
+                participant.outcomes.append(question_index, status, 0, SECONDS_PER_QUESTION)
+        # The session's own outcomes only track which questions were played; points holds how many players answered
+        if self.round_correct: round_status = 'correct'
+        elif self.round_answers: round_status = 'wrong'
+        else: round_status = status
+        self.outcomes.append(question_index, round_status, len(self.round_answers), SECONDS_PER_QUESTION)
+        self.round_answers = set()
+        self.round_correct = 0
+
+    def schedule_leaderboard(self):
+        """Makes sure the leaderboard is refreshed soon, without refreshing it for every answer."""
+        if self.leaderboard_due or self.is_finished:
+            return
+        self.leaderboard_due = True
+        delay = max(0.0, self.last_flush + LEADERBOARD_INTERVAL - time.time())
+        TIMEOUTS.arm(self.leaderboard_key, delay, self.flush_leaderboard)
+
+    def leaderboard_text(self, title: str) -> str:
+        names = {user_id: self.participants[user_id].name for user_id, _ in self.leaderboard.top(LEADERBOARD_SIZE)}
+        return (f"{title}\n\n{self.leaderboard.render(names, LEADERBOARD_SIZE)}\n\n"
+                f"    👥 Players  »  <code>{len(self.participants)}</code>")
+
+    async def flush_leaderboard(self):
+        self.leaderboard_due = False
+        if self.is_finished or self.is_suspended:
+            return
+        self.last_flush = time.time()
+        text = self.leaderboard_text(f"📊 <b>𝐋𝐈𝐕𝐄 𝐋𝐄𝐀𝐃𝐄𝐑𝐁𝐎𝐀𝐑𝐃 » {escape(self.quiz_name)}</b>")
+        try:
+            if self.leaderboard_message_id is None:
+                message = await SENDER.send_message(self.bot, self.chat_id, text, priority=PRIORITY_COSMETIC, parse_mode='HTML')
+                self.leaderboard_message_id = message.message_id
+            else:
+                # Edits of the same message are coalesced by the scheduler, so only the newest one is sent
+                await SENDER.edit_message_text(self.bot, self.chat_id, self.leaderboard_message_id, text, parse_mode='HTML')
+        except BadRequest as e:
+            logging.warning(f"Leaderboard update failed for chat {self.chat_id}: {e}")
+
+    async def suspend_quiz(self, reason: str = "inactivity"):
+        TIMEOUTS.cancel(self.leaderboard_key)
+        await super().suspend_quiz(reason)
+
+    async def show_final_score(self):
+        if self.is_suspended: return
+        self.is_finished = True
+        TIMEOUTS.cancel(self.leaderboard_key)
+        await self.discard()
+        records = {
+            f"{self.session_id}:{user_id}": {'outcomes': p.outcomes, 'quiz_name': self.quiz_name, 'set_id': self.set_id,
+                                             'bank_version': self.bank.version, 'total_score': p.score}
+            for user_id, p in self.participants.items()
+        }
+        if records:
+            try: await RESULT_STORE.save_many(records)
+            except Exception as e: logging.error(f"Failed to save group results for {self.session_id}: {e}")
+        if ANALYTICS:
+            for user_id, p in self.participants.items():
+                ANALYTICS.record(user_id, self.set_id, self.bank.version, p.outcomes, p.score)
+        score_text = self.leaderboard_text(f"⫷ 🏆 <b>𝐅𝐈𝐍𝐀𝐋 𝐒𝐂𝐎𝐑𝐄 » {escape(self.quiz_name)}</b> 🏆 ⫸")
+        keyboard = [[InlineKeyboardButton("📊 My Detailed Review", callback_data=f'group_review:{self.session_id}')], [InlineKeyboardButton("🔄      Try Again      🔄", callback_data=f'try_again:{self.set_id}')]]
+        await SENDER.send_message(self.bot, self.chat_id, score_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+
+def restore_session(bot, bot_data: dict, state: dict, bank: QuestionBank) -> QuizSession:
+    """Rebuilds a saved session of either kind."""
+    session_class = GroupQuizSession if state.get('mode') == 'group' else QuizSession
+    return session_class.from_state(bot, bot_data, state, bank)
@@ -0,0 +1,213 @@
+# question_bank.py
+
+"""
+This module is the "Librarian". It turns the raw 'questions' JSON of a quiz set
+into a compiled, read-only QuestionBank once, when the set is loaded. Every
+session playing that set shares the same bank and only keeps its own shuffled
+order of question indexes.
+
+Sets too big to load whole keep their questions as rows of their own table. For
+those, the shared object is a RowQuizSet (just the set's metadata), and every
+session draws its own SampledBank: a few random questions, loaded page by page.
+
+Sessions and reviews treat both the same way, through for_session(), quiz_order(),
+fetch(), prefetch() and load_all().
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import sys
+from html import escape
+
+class QuestionLoadError(Exception):
+    """A page of questions couldn't be loaded (unlike a row that is gone, trying again may help)."""
+
+class Question:
+    """One compiled question. Treat as read-only: it is shared by every session."""
+    __slots__ = ('id', 'text', 'options', 'correct_option_id', 'html_text', 'html_options')
+
+    def __init__(self, qid, text: str, options, correct_option_id: int):
+        self.id = qid
+        self.text = text
+        # A tuple, so it can be handed straight to send_poll by every session
+        self.options = tuple(options)
+        self.correct_option_id = correct_option_id
+        # Pre-escaped once here instead of on every review line
+        self.html_text = escape(text)
+        self.html_options = tuple(escape(opt) for opt in self.options)
+
+class QuestionBank:
+    """A compiled quiz set: questions in a tuple plus an id -> index map."""
+    __slots__ = ('set_id', 'name', 'version', 'questions', 'index_by_id', 'size')
+
+    def __init__(self, set_id: str, name: str, version: str, questions: tuple, size: int):
+        self.set_id = set_id
+        self.name = name
+        self.version = version
+        self.questions = questions
+        self.index_by_id = {q.id: i for i, q in enumerate(questions)}
+        self.size = size
+
+    def __len__(self):
+        return len(self.questions)
+
+    def __getitem__(self, index: int) -> Question:
+        return self.questions[index]
+
+    def get_by_id(self, qid):
+        """Finds a question by its original id, or None."""
+        index = self.index_by_id.get(qid)
+        return None if index is None else self.questions[index]
+
+    # A compiled bank is already complete, so a session simply shares it and plays all of it
+    def for_session(self, positions=None):
+        return self
+
+    def quiz_order(self) -> list:
+        order = list(range(len(self.questions)))
+        random.shuffle(order)
+        return order
+
+    async def fetch(self, index: int) -> Question:
+        return self.questions[index]
+
+    def prefetch(self, index: int):
+        pass
+
+    async def load_all(self):
+        pass
+
+class RowQuizSet:
+    """
+    A quiz set whose `count` questions are rows in their own table, numbered 0..count-1
+    by a `position` column. Only this metadata is cached and shared; each session plays
+    `sample_size` randomly drawn questions. `loader(set_id, positions)` is an async
+    function returning {position: Question} for the requested rows.
+    """
+    __slots__ = ('set_id', 'name', 'version', 'count', 'sample_size', 'page_size', 'loader', 'size')
+
+    def __init__(self, set_id: str, name: str, version: str, count: int, sample_size: int, page_size: int, loader):
+        self.set_id = set_id
+        self.name = name
+        self.version = version
+        self.count = count
+        self.sample_size = sample_size
+        self.page_size = page_size
+        self.loader = loader
+        self.size = sys.getsizeof(self) + 200
+
+    def __len__(self):
+        return self.count
+
+    def for_session(self, positions=None):
+        """A SampledBank of random questions, or of exactly `positions` (to resume or review a quiz)."""
+        if positions is None:
+            positions = random.sample(range(self.count), min(self.sample_size, self.count))
+        return SampledBank(self, list(dict.fromkeys(positions)))
+
+class SampledBank:
+    """
+    The questions one session plays from a RowQuizSet, in play order. They are loaded
+    `page_size` at a time: fetching a question loads its page if needed and starts
+    loading the next one in the background, while the user is answering.
+    Indexes are row positions in the whole set, so stored outcomes can be reviewed later.
+    """
+    __slots__ = ('set_id', 'name', 'version', 'count', 'positions', 'page_size', 'loader',
+                 'questions', 'page_of', 'loaded_pages', 'loading')
+
+    def __init__(self, quiz_set: RowQuizSet, positions: list):
+        self.set_id = quiz_set.set_id
+        self.name = quiz_set.name
+        self.version = quiz_set.version
+        self.count = quiz_set.count
+        self.positions = positions
+        self.page_size = quiz_set.page_size
+        self.loader = quiz_set.loader
+        self.questions = {}  # position -> Question, for loaded pages
+        self.page_of = {position: i // self.page_size for i, position in enumerate(positions)}
+        self.loaded_pages = set()
+        self.loading = {}  # page -> task loading it
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position: int) -> Question:
+        """Only for questions whose page is loaded; use fetch() otherwise."""
+        return self.questions[position]
+
+    def for_session(self, positions=None):
+        return self
+
+    def quiz_order(self) -> list:
+        return list(self.positions)
+
+    def _load_page(self, page: int):
+        task = self.loading.get(page)
+        if task is None:
+            async def load():
+                # Returns whether the page loaded, so a prefetch nobody waits for never leaves an unretrieved exception
+                try:
+                    chunk = self.positions[page * self.page_size:(page + 1) * self.page_size]
+                    self.questions.update(await self.loader(self.set_id, chunk))
+                    self.loaded_pages.add(page)
+                    return True
+                except Exception as e:
+                    # Not marked as loaded, so the next fetch() tries again
+                    logging.error(f"Failed to load questions page {page} of '{self.set_id}': {e}")
+                    return False
+                finally:
+                    del self.loading[page]
+            task = self.loading[page] = asyncio.get_running_loop().create_task(load())
+        return task
+
+    async def fetch(self, position: int):
+        """
+        The question at `position`, loading its page first if needed. None if the page loaded but
+        the row is gone; raises QuestionLoadError if the page couldn't be loaded.
+        """
+        page = self.page_of.get(position)
+        if page is None:
+            return None
+        if page not in self.loaded_pages and not await self._load_page(page):
+            raise QuestionLoadError(f"Questions page {page} of '{self.set_id}' couldn't be loaded")
+        self.prefetch_page(page + 1)
+        return self.questions.get(position)
+
+    def prefetch_page(self, page: int):
+        if page * self.page_size < len(self.positions) and page not in self.loaded_pages:
+            self._load_page(page)
+
+    def prefetch(self, position: int):
+        """Starts loading the page holding `position` without waiting for it."""
+        page = self.page_of.get(position)
+        if page is not None:
+            self.prefetch_page(page)
+
+    async def load_all(self):
+        pages = (len(self.positions) + self.page_size - 1) // self.page_size
+        await asyncio.gather(*(self._load_page(page) for page in range(pages) if page not in self.loaded_pages))
+
+def row_set_version(set_id: str, count: int, updated_at) -> str:
+    """Version of a row-backed set: it changes when the set's row is edited or its question count changes."""
+    return hashlib.sha1(f"{set_id}:{count}:{updated_at}".encode('utf-8')).hexdigest()[:12]
+
+def _question_size(q: Question) -> int:
+    return (sys.getsizeof(q) + sys.getsizeof(q.text) + sys.getsizeof(q.html_text)
+            + sum(sys.getsizeof(o) for o in q.options) + sum(sys.getsizeof(o) for o in q.html_options))
+
+def compile_question(q: dict) -> Question:
+    return Question(q['id'], q['question'], q['options'], q['correct_option_id'])
+
+def compile_quiz_set(set_id: str, data: dict) -> QuestionBank:
+    """Builds a QuestionBank from a `quizzes` row ({'name': ..., 'questions': [...]})."""
+    raw_questions = data.get('questions') or []
+    questions = tuple(compile_question(q) for q in raw_questions)
+    # The version changes whenever the questions change, so stored results can tell
+    # whether the bank they were played against is still the one we have.
+    encoded = json.dumps(raw_questions, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    version = hashlib.sha1(encoded).hexdigest()[:12]
+    size = sum(_question_size(q) for q in questions) + len(questions) * 100
+    return QuestionBank(set_id, data.get('name', f"Quiz {set_id}"), version, questions, size)
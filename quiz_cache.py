@@ -0,0 +1,108 @@
+# quiz_cache.py
+
+"""
+This module is the "Pantry". It keeps recently used quiz data in memory,
+throws out the least recently used entries when it gets too full, and knows
+when something has been sitting there long enough that it should be re-fetched.
+"""
+
+import json
+import time
+from collections import OrderedDict
+
+FRESH = 'fresh'
+STALE = 'stale'
+
+def estimate_size(value) -> int:
+    """Rough size of a cached value in bytes, based on its JSON encoding."""
+    try:
+        return len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+    except (TypeError, ValueError):
+        return 0
+
+class QuizCache:
+    """
+    An LRU cache bounded by entry count and by approximate memory use.
+
+    Every entry is FRESH for `ttl` seconds, then STALE for another `stale_ttl`
+    seconds (still served, but the caller should refresh it in the background),
+    and after that it is treated as a miss.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float, stale_ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()  # key -> (value, size, stored_at)
+        self.total_bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns (value, FRESH or STALE) on a hit, or (None, None) on a miss."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, None
+
+        value, _, stored_at = entry
+        age = time.monotonic() - stored_at
+        if age > self.ttl + self.stale_ttl:
+            self._remove(key)
+            self.misses += 1
+            return None, None
+
+        self._entries.move_to_end(key)
+        if age > self.ttl:
+            self.stale_hits += 1
+            return value, STALE
+        self.hits += 1
+        return value, FRESH
+
+    def put(self, key, value, size: int = None):
+        if size is None:
+            size = estimate_size(value)
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, size, time.monotonic())
+        self.total_bytes += size
+
+        # Evict least recently used entries, but never the one we just stored
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Drops one entry, or everything when no key is given."""
+        if key is None:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self.total_bytes = 0
+        elif key in self._entries:
+            self._remove(key)
+            self.invalidations += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_ratio': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
@@ -1,46 +1,147 @@
 # quiz_manager.py
 import os
-from supabase import create_client, Client
+import asyncio
+import threading
+from quiz_cache import QuizCache, FRESH, STALE
+from question_bank import compile_quiz_set, compile_question, row_set_version, RowQuizSet
+from quiz_snapshot import QuizSnapshot
+from metrics import timed, SUPABASE_FETCH
 
 # --- Database Connection ---
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = None
-if url and key:
-    try:
-        supabase = create_client(url, key)
-        print("✅ Successfully connected to Supabase.")
-    except Exception as e:
-        print(f"❌ CRITICAL: Failed to create Supabase client: {e}")
-else:
+# Connections kept open to Supabase, shared by all queries (they run in worker threads)
+SUPABASE_POOL_SIZE = int(os.environ.get("SUPABASE_POOL_SIZE", "20"))
+SUPABASE_TIMEOUT = float(os.environ.get("SUPABASE_TIMEOUT", "10"))
+
+# The client is only built when the first query needs it (importing supabase alone takes a good
+# half second), and that first query runs in a worker thread, so startup never waits for it.
+# Tools and tests can put their own client here instead.
+supabase = None
+_supabase_failed = False
+_supabase_lock = threading.Lock()
+if not (url and key):
     print("⚠️ WARNING: SUPABASE_URL or SUPABASE_KEY not found.")
 
-# This is our in-memory storage (the cache)
-QUIZ_CACHE = {}
+def supabase_available() -> bool:
+    """Whether there is (or can be) a Supabase client, without building it."""
+    return supabase is not None or (bool(url and key) and not _supabase_failed)
+
+def get_supabase():
+    """Blocking: the Supabase client, built on first use. None if it isn't configured or couldn't be built."""
+    global supabase, _supabase_failed
+    if supabase is None and supabase_available():
+        with _supabase_lock:
+            if supabase is None and not _supabase_failed:
+                try:
+                    supabase = _create_supabase()
+                    print("✅ Successfully connected to Supabase.")
+                except Exception as e:
+                    _supabase_failed = True
+                    print(f"❌ CRITICAL: Failed to create Supabase client: {e}")
+    return supabase
+
+def _create_supabase():
+    import httpx
+    from supabase import create_client
+    from supabase.lib.client_options import SyncClientOptions
+    # One keep-alive pool for every query, instead of a new connection (and TLS handshake) per request
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=SUPABASE_POOL_SIZE, max_keepalive_connections=SUPABASE_POOL_SIZE),
+        timeout=SUPABASE_TIMEOUT, follow_redirects=True,
+    )
+    return create_client(url, key, SyncClientOptions(httpx_client=http_client))
+
+def close_supabase():
+    """Closes the shared connection pool, if the client was ever built."""
+    client = supabase
+    http_client = getattr(getattr(client, 'options', None), 'httpx_client', None)
+    if http_client is not None:
+        http_client.close()
+
+# --- Cache Settings ---
+QUIZ_CACHE_MAX_SETS = int(os.environ.get("QUIZ_CACHE_MAX_SETS", "200"))
+QUIZ_CACHE_MAX_BYTES = int(os.environ.get("QUIZ_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+QUIZ_CACHE_TTL = float(os.environ.get("QUIZ_CACHE_TTL", "600"))
+QUIZ_CACHE_STALE_TTL = float(os.environ.get("QUIZ_CACHE_STALE_TTL", "3600"))
+MENU_CACHE_TTL = float(os.environ.get("MENU_CACHE_TTL", "300"))
+
+# This is our in-memory storage (the cache) for full question banks
+QUIZ_CACHE = QuizCache(QUIZ_CACHE_MAX_SETS, QUIZ_CACHE_MAX_BYTES, QUIZ_CACHE_TTL, QUIZ_CACHE_STALE_TTL)
+# The start menu gets its own tiny cache, since it changes far less often than it is shown
+MENU_CACHE = QuizCache(1, QUIZ_CACHE_MAX_BYTES, MENU_CACHE_TTL, MENU_CACHE_TTL)
+MENU_KEY = 'all_sets'
 
-def get_quiz_set(set_id: str):
+# --- Local Snapshot ---
+# Every quiz set is also kept in this file, so restarts (and Supabase outages) don't start from nothing.
+# Set QUIZ_SNAPSHOT_PATH to an empty string to turn it off.
+QUIZ_SNAPSHOT_PATH = os.environ.get("QUIZ_SNAPSHOT_PATH", "quiz_snapshot.bin")
+# Column telling when a set was last edited; sets whose value hasn't changed aren't downloaded again
+QUIZ_UPDATED_COLUMN = os.environ.get("QUIZ_UPDATED_COLUMN", "updated_at")
+QUIZ_REFRESH_INTERVAL = float(os.environ.get("QUIZ_REFRESH_INTERVAL", "600"))
+PRELOAD_BATCH_SIZE = int(os.environ.get("PRELOAD_BATCH_SIZE", "50"))
+
+SNAPSHOT = QuizSnapshot(QUIZ_SNAPSHOT_PATH)
+
+# --- Large Sets ---
+# A set whose 'questions' column is empty keeps its questions as rows of this table instead
+# (set_id, position 0..n-1, id, question, options, correct_option_id). Each quiz then plays
+# the set's 'sample_size' (or QUIZ_SAMPLE_SIZE) random questions, loaded QUESTION_PAGE_SIZE at a time.
+QUESTIONS_TABLE = os.environ.get("QUESTIONS_TABLE", "questions")
+QUIZ_SAMPLE_SIZE = int(os.environ.get("QUIZ_SAMPLE_SIZE", "20"))
+QUESTION_PAGE_SIZE = int(os.environ.get("QUESTION_PAGE_SIZE", "10"))
+
+# Queries currently running, keyed by what they fetch. Everyone asking for the
+# same thing while a query is in flight waits on that one query.
+_IN_FLIGHT = {}
+
+async def _single_flight(flight_key, func, *args):
     """
-    "Smart" function: first checks cache, then falls back to Supabase.
+    Runs the blocking `func(*args)` in a worker thread so the event loop stays free,
+    and makes concurrent callers with the same `flight_key` share a single call.
     """
-    # 1. Check the cache first
-    if set_id in QUIZ_CACHE and 'questions' in QUIZ_CACHE[set_id]:
-        print(f"✅ Found '{set_id}' with questions in cache.")
-        return QUIZ_CACHE[set_id]
+    task = _IN_FLIGHT.get(flight_key)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(asyncio.to_thread(func, *args))
+        _IN_FLIGHT[flight_key] = task
+        task.add_done_callback(lambda _: _IN_FLIGHT.pop(flight_key, None))
+    # shield() so one impatient caller being cancelled doesn't cancel the query for everyone else
+    return await asyncio.shield(task)
 
-    # 2. If not in cache or incomplete, search in Supabase
-    if not supabase:
-        return None
+# Strong references to background refreshes, so they aren't garbage collected mid-flight
+_BACKGROUND_REFRESHES = set()
+
+def _refresh_in_background(flight_key, cache, cache_key, func, *args):
+    """Stale-while-revalidate: re-fetch an entry without making the current caller wait."""
+    if flight_key in _IN_FLIGHT:
+        return
 
+    async def refresh():
+        data = await _single_flight(flight_key, func, *args)
+        # On failure, keep serving the stale copy until it fully expires
+        if data:
+            cache.put(cache_key, data, getattr(data, 'size', None))
+
+    task = asyncio.get_running_loop().create_task(refresh())
+    _BACKGROUND_REFRESHES.add(task)
+    task.add_done_callback(_BACKGROUND_REFRESHES.discard)
+
+@timed(SUPABASE_FETCH, 'quiz_set', span_name='supabase.quiz_set')
+def _fetch_quiz_set(set_id: str):
+    """
+    Blocking Supabase query for one quiz set, compiled into a QuestionBank.
+    Only ever called from a worker thread, so compiling doesn't block the loop either.
+    """
     print(f"🟡 '{set_id}' not in cache. Searching in Supabase...")
     try:
-        # *** THE FIX IS HERE: We now fetch 'name' AND 'questions' ***
-        response = supabase.table('quizzes').select('name', 'questions').eq('set_id', set_id).single().execute()
+        # All columns: 'name' and 'questions', plus 'sample_size' and the edit time for large sets
+        response = get_supabase().table('quizzes').select('*').eq('set_id', set_id).single().execute()
         
         if response.data:
             print(f"👍 Found '{set_id}' in Supabase. Caching it.")
-            # 3. Store the complete data in the cache
-            QUIZ_CACHE[set_id] = response.data
-            return response.data
+            if response.data.get('questions') is None:
+                return _row_quiz_set(set_id, response.data)
+            return compile_quiz_set(set_id, response.data)
         else:
             print(f"❌ '{set_id}' not found in Supabase.")
             return None
@@ -48,24 +149,171 @@ def get_quiz_set(set_id: str):
         print(f"Error fetching from Supabase: {e}")
         return None
 
-def get_all_sets():
-    """
-    This function gets the list of all quizzes for the start menu.
-    """
-    if not supabase:
-        return {}
-        
+def _row_quiz_set(set_id: str, data: dict) -> RowQuizSet:
+    """Blocking: counts the rows of a large set; its questions themselves are only loaded as they are played."""
+    response = get_supabase().table(QUESTIONS_TABLE).select('position', count='exact').eq('set_id', set_id).limit(1).execute()
+    count = response.count or 0
+    return RowQuizSet(
+        set_id, data.get('name', f"Quiz {set_id}"), row_set_version(set_id, count, data.get(QUIZ_UPDATED_COLUMN)),
+        count, data.get('sample_size') or QUIZ_SAMPLE_SIZE, QUESTION_PAGE_SIZE, _load_question_page,
+    )
+
+@timed(SUPABASE_FETCH, 'question_page', span_name='supabase.question_page')
+def _fetch_question_page(set_id: str, positions: list) -> dict:
+    """Blocking: the questions at `positions` of a large set, as {position: Question}."""
+    response = (get_supabase().table(QUESTIONS_TABLE).select('position', 'id', 'question', 'options', 'correct_option_id')
+                .eq('set_id', set_id).in_('position', positions).execute())
+    return {row['position']: compile_question(row) for row in response.data or []}
+
+async def _load_question_page(set_id: str, positions: list) -> dict:
+    return await asyncio.to_thread(_fetch_question_page, set_id, positions)
+
+def _load_quiz_set(set_id: str):
+    """Blocking: the set from the local snapshot if it has it, otherwise from Supabase."""
+    try:
+        bank = SNAPSHOT.load(set_id)
+    except Exception as e:
+        print(f"Error reading '{set_id}' from the quiz snapshot: {e}")
+        bank = None
+    if bank is None and supabase_available():
+        bank = _fetch_quiz_set(set_id)
+    return bank
+
+@timed(SUPABASE_FETCH, 'all_sets', span_name='supabase.all_sets')
+def _fetch_all_sets():
+    """Blocking Supabase query for the start menu. Only ever called from a worker thread."""
     try:
-        response = supabase.table('quizzes').select('set_id', 'name').execute()
+        response = get_supabase().table('quizzes').select('set_id', 'name').execute()
         if response.data:
-            all_sets = {item['set_id']: {'name': item['name']} for item in response.data}
-            # Also, update our cache with the names
-            for set_id, data in all_sets.items():
-                if set_id not in QUIZ_CACHE:
-                    QUIZ_CACHE[set_id] = {}
-                QUIZ_CACHE[set_id]['name'] = data['name']
-            return all_sets
+            return {item['set_id']: {'name': item['name']} for item in response.data}
         return {}
     except Exception as e:
         print(f"Error fetching all sets from Supabase: {e}")
         return {}
+
+def _list_sets():
+    """Blocking: set_id, name and (if the table has it) last edit time of every set, without the questions."""
+    try:
+        return get_supabase().table('quizzes').select('set_id', 'name', QUIZ_UPDATED_COLUMN).execute().data or []
+    except Exception as e:
+        print(f"Couldn't list quiz sets with '{QUIZ_UPDATED_COLUMN}' ({e}), comparing full sets instead.")
+    return get_supabase().table('quizzes').select('set_id', 'name').execute().data or []
+
+@timed(SUPABASE_FETCH, 'preload', span_name='supabase.preload')
+def _preload_sets():
+    """
+    Blocking: brings the snapshot up to date with Supabase. Only sets that are new or whose
+    QUIZ_UPDATED_COLUMN changed are downloaded, PRELOAD_BATCH_SIZE sets per query. Returns
+    (menu, banks) with a compiled bank for each downloaded set, or None if Supabase failed.
+    """
+    try:
+        listing = _list_sets()
+        known = SNAPSHOT.entries()
+        current = {row['set_id']: row.get(QUIZ_UPDATED_COLUMN) for row in listing}
+        # Without an edit time we can't tell what changed, so those sets are downloaded and compared by version
+        changed = [set_id for set_id, updated_at in current.items()
+                   if updated_at is None or set_id not in known or known[set_id][1] != updated_at]
+
+        rows, banks = {}, {}
+        for start in range(0, len(changed), PRELOAD_BATCH_SIZE):
+            batch = changed[start:start + PRELOAD_BATCH_SIZE]
+            response = get_supabase().table('quizzes').select('set_id', 'name', 'questions').in_('set_id', batch).execute()
+            for row in response.data or []:
+                if row.get('questions') is None:
+                    # A large set: its questions are rows of QUESTIONS_TABLE and are never preloaded
+                    current.pop(row['set_id'], None)
+                    continue
+                bank = compile_quiz_set(row['set_id'], row)
+                rows[row['set_id']] = (row, current.get(row['set_id']), bank.version)
+                banks[row['set_id']] = bank
+    except Exception as e:
+        print(f"Error preloading quiz sets from Supabase: {e}")
+        return None
+
+    updated = [set_id for set_id, (_, _, version) in rows.items() if set_id not in known or known[set_id][2] != version]
+    # A new name or edit time alone must be recorded too, or the set is downloaded again on every refresh
+    relabeled = [set_id for set_id, (row, updated_at, _) in rows.items()
+                 if set_id in known and known[set_id][:2] != (row.get('name') or f"Quiz {set_id}", updated_at)]
+    if updated or relabeled or set(known) != set(current):
+        keep = {set_id: updated_at for set_id, updated_at in current.items() if set_id not in rows}
+        try:
+            SNAPSHOT.write(rows, keep)
+        except OSError as e:
+            print(f"Couldn't write the quiz snapshot: {e}")
+    print(f"📦 {len(current)} quiz sets known, {len(updated)} new or changed in Supabase.")
+    menu = {row['set_id']: {'name': row['name']} for row in listing}
+    return menu, banks
+
+async def preload_quiz_sets():
+    """
+    Brings the local snapshot up to date and puts every set that had to be downloaded in the
+    cache. Meant to run in the background: at startup, then every QUIZ_REFRESH_INTERVAL seconds.
+    """
+    if not supabase_available():
+        return
+    result = await _single_flight(('preload',), _preload_sets)
+    if result is None:
+        return
+    menu, banks = result
+    if menu:
+        MENU_CACHE.put(MENU_KEY, menu)
+    for set_id, bank in banks.items():
+        QUIZ_CACHE.put(set_id, bank, bank.size)
+
+async def get_quiz_set(set_id: str):
+    """
+    "Smart" function: first checks cache, then falls back to Supabase.
+    Returns a compiled QuestionBank, or None.
+    """
+    # 1. Check the cache first
+    cached, state = QUIZ_CACHE.get(set_id)
+    if state == FRESH:
+        return cached
+    if state == STALE:
+        print(f"🔄 '{set_id}' in cache is stale. Serving it and refreshing in the background.")
+        if supabase_available():
+            _refresh_in_background(('set', set_id), QUIZ_CACHE, set_id, _fetch_quiz_set, set_id)
+        return cached
+
+    # 2. If not in cache, load it from the local snapshot or, failing that, from Supabase
+    bank = await _single_flight(('set', set_id), _load_quiz_set, set_id)
+    if bank is not None:
+        # 3. Store the compiled bank in the cache
+        QUIZ_CACHE.put(set_id, bank, bank.size)
+    return bank
+
+async def get_all_sets():
+    """
+    This function gets the list of all quizzes for the start menu.
+    """
+    cached, state = MENU_CACHE.get(MENU_KEY)
+    if state == FRESH:
+        return cached
+    if state == STALE:
+        if supabase_available():
+            _refresh_in_background(('menu',), MENU_CACHE, MENU_KEY, _fetch_all_sets)
+        return cached
+
+    if not supabase_available():
+        return SNAPSHOT.menu()
+
+    all_sets = await _single_flight(('menu',), _fetch_all_sets)
+    # Don't cache an empty menu, it usually means the query failed; show what the snapshot has instead
+    if all_sets:
+        MENU_CACHE.put(MENU_KEY, all_sets)
+    else:
+        all_sets = SNAPSHOT.menu()
+    return all_sets
+
+def invalidate_cache(set_id: str = None):
+    """
+    Forgets a cached quiz set (or every set when no id is given) and the start menu,
+    so the next request re-reads them from Supabase. Used after edits in the database.
+    """
+    SNAPSHOT.forget(set_id)
+    QUIZ_CACHE.invalidate(set_id)
+    MENU_CACHE.invalidate()
+
+def cache_stats() -> dict:
+    """Hit/miss/eviction counters for the question bank cache and the menu cache."""
+    return {'quiz_sets': QUIZ_CACHE.stats(), 'menu': MENU_CACHE.stats()}
@@ -0,0 +1,153 @@
+# quiz_snapshot.py
+
+"""
+This module is the "Cellar". It keeps a copy of every quiz set on local disk, so
+a freshly started bot can serve quizzes without waiting for Supabase (or while
+Supabase is down).
+
+The snapshot is a single file: a small JSON index followed by one zlib-compressed
+blob per set, holding exactly the row Supabase returned ({'name', 'questions'}).
+Compiling a blob therefore gives the same QuestionBank, version included, as
+fetching the set fresh. The file is memory-mapped: opening it only reads the index,
+and a set's blob is only read and compiled the first time that set is played.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from question_bank import compile_quiz_set
+
+MAGIC = b'QZSNAP01'
+_HEADER = struct.Struct('<8sI')  # magic, index length
+
+class QuizSnapshot:
+    """
+    A memory-mapped snapshot file. The index maps set_id -> (name, updated_at, version,
+    offset, length); offsets are relative to the end of the index. Thread safe, since
+    sets are loaded from worker threads while a refresh may be swapping the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._data_start = 0
+        self._index = {}
+        self.saved_at = None
+        if path:
+            self._open()
+
+    def _open(self):
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, index_length = _HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC:
+                raise ValueError("not a quiz snapshot")
+            index = json.loads(mapped[_HEADER.size:_HEADER.size + index_length])
+        except (ValueError, struct.error, OSError) as e:
+            logging.warning(f"Ignoring unreadable quiz snapshot {self.path}: {e}")
+            file.close()
+            return
+        self._file, self._map = file, mapped
+        self._data_start = _HEADER.size + index_length
+        self._index = {set_id: tuple(entry) for set_id, entry in index['sets'].items()}
+        self.saved_at = index.get('saved_at')
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._file.close()
+            self._file = self._map = None
+            self._index = {}
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, set_id):
+        return set_id in self._index
+
+    def entries(self) -> dict:
+        """set_id -> (name, updated_at, version), for deciding what needs refreshing."""
+        return {set_id: entry[:3] for set_id, entry in self._index.items()}
+
+    def menu(self) -> dict:
+        """The start menu as get_all_sets() returns it."""
+        return {set_id: {'name': entry[0]} for set_id, entry in self._index.items()}
+
+    def _read(self, set_id: str):
+        """A set's index entry and blob, read together under the lock; (None, None) if it isn't in there."""
+        with self._lock:
+            entry = self._index.get(set_id)
+            if entry is None:
+                return None, None
+            offset, length = entry[3], entry[4]
+            start = self._data_start + offset
+            return entry, self._map[start:start + length]
+
+    def load(self, set_id: str):
+        """Compiles one set from the snapshot into a QuestionBank, or None if it isn't in there."""
+        _, blob = self._read(set_id)
+        if blob is None:
+            return None
+        return compile_quiz_set(set_id, json.loads(zlib.decompress(blob)))
+
+    def forget(self, set_id: str = None):
+        """Stops serving a set (or all of them) from the snapshot until it is next written, e.g. after /reload."""
+        with self._lock:
+            if set_id is None:
+                self._index = {}
+            else:
+                self._index.pop(set_id, None)
+
+    def write(self, rows: dict, keep: dict):
+        """
+        Writes a new snapshot and switches to it. `rows` maps set_id -> (row, updated_at, version)
+        for sets with new data; `keep` maps set_id -> updated_at for sets whose current blob is
+        still good and is copied over as is. Everything else is dropped.
+        """
+        if not self.path:
+            return
+        index, blobs, offset = {}, [], 0
+        for set_id, updated_at in keep.items():
+            # forget() may drop entries at any moment (e.g. /reload), so the entry is read with its blob
+            entry, blob = self._read(set_id)
+            if blob is None:
+                continue
+            name, _, version = entry[:3]
+            index[set_id] = [name, updated_at, version, offset, len(blob)]
+            blobs.append(blob)
+            offset += len(blob)
+        for set_id, (row, updated_at, version) in rows.items():
+            blob = zlib.compress(json.dumps({'name': row.get('name'), 'questions': row.get('questions')}).encode())
+            index[set_id] = [row.get('name') or f"Quiz {set_id}", updated_at, version, offset, len(blob)]
+            blobs.append(blob)
+            offset += len(blob)
+
+        header = json.dumps({'saved_at': time.time(), 'sets': index}).encode()
+        # Write next to the old file and swap, so a crash never leaves half a snapshot behind
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, len(header)))
+            f.write(header)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(temp_path, self.path)
+        with self._lock:
+            old_file, old_map = self._file, self._map
+            self._file = self._map = None
+            self._index = {}
+            self._open()
+        if old_map is not None:
+            old_map.close()
+            old_file.close()
@@ -0,0 +1,203 @@
+# result_store.py
+
+"""
+This module is the "Archive". It keeps finished quiz results around long enough
+for the "Detailed Review" button to work. Only the set id, the bank version and
+a compact list of per-question outcomes are stored; the questions themselves are
+looked up again in the shared QuestionBank when a review is requested.
+"""
+
+import asyncio
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import sys
+import time
+from array import array
+from metrics import timed, RESULT_WRITE
+
+RESULT_STORE_BACKEND = os.environ.get("RESULT_STORE", "sqlite")
+RESULT_DB_PATH = os.environ.get("RESULT_DB_PATH", "results.db")
+RESULT_RETENTION_HOURS = float(os.environ.get("RESULT_RETENTION_HOURS", "48"))
+
+# Status names are stored as small integer codes
+STATUSES = ('correct', 'wrong', 'skipped', 'timed_out', 'stopped')
+STATUS_CODES = {name: code for code, name in enumerate(STATUSES)}
+
+class Outcomes:
+    """
+    A session's per-question results, kept column-wise in typed arrays instead of a
+    list of dicts: about 15 bytes per answered question.
+    """
+    __slots__ = ('question_index', 'status', 'points', 'time_taken', 'answered_option_id')
+
+    def __init__(self):
+        self.question_index = array('I')
+        self.status = array('b')
+        self.points = array('i')
+        self.time_taken = array('f')
+        self.answered_option_id = array('b')  # -1 = not answered
+
+    def __len__(self):
+        return len(self.status)
+
+    def append(self, question_index: int, status: str, points: int, time_taken: float, answered_option_id=None):
+        self.question_index.append(question_index)
+        self.status.append(STATUS_CODES[status])
+        self.points.append(points)
+        self.time_taken.append(time_taken)
+        self.answered_option_id.append(-1 if answered_option_id is None else answered_option_id)
+
+    def count(self, status: str) -> int:
+        return self.status.count(STATUS_CODES[status])
+
+    def nbytes(self) -> int:
+        return sum(sys.getsizeof(column) for column in (self.question_index, self.status, self.points, self.time_taken, self.answered_option_id))
+
+    def to_bytes(self) -> bytes:
+        """Packs the outcomes as 5 ints each: question index, status code, points, time in ms, answered option."""
+        packed = array('i')
+        for row in zip(self.question_index, self.status, self.points, self.time_taken, self.answered_option_id):
+            packed.extend((row[0], row[1], row[2], int(row[3] * 1000), row[4]))
+        return packed.tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob: bytes):
+        packed = array('i')
+        packed.frombytes(blob)
+        outcomes = cls()
+        for i in range(0, len(packed), 5):
+            outcomes.question_index.append(packed[i])
+            outcomes.status.append(packed[i + 1])
+            outcomes.points.append(packed[i + 2])
+            outcomes.time_taken.append(packed[i + 3] / 1000)
+            outcomes.answered_option_id.append(packed[i + 4])
+        return outcomes
+
+class ResultStore(ABC):
+    """
+    Base class for result backends. A record is a dict with 'set_id', 'bank_version',
+    'quiz_name', 'total_score' and 'outcomes' (an Outcomes).
+    """
+
+    @abstractmethod
+    async def save(self, session_id: str, record: dict) -> None:
+        raise NotImplementedError
+
+    async def save_many(self, records: dict) -> None:
+        """Saves several records at once (session_id -> record), e.g. every player of a group quiz."""
+        for session_id, record in records.items():
+            await self.save(session_id, record)
+
+    @abstractmethod
+    async def load(self, session_id: str):
+        """Returns the record, or None if it doesn't exist or has expired."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def purge_expired(self) -> int:
+        """Deletes expired records and returns how many were removed."""
+        raise NotImplementedError
+
+class MemoryResultStore(ResultStore):
+    """Keeps records in a dict. Handy for local runs and load tests; lost on restart."""
+
+    def __init__(self, retention_seconds: float):
+        self.retention_seconds = retention_seconds
+        self._records = {}  # session_id -> (saved_at, record with packed outcomes)
+
+    @timed(RESULT_WRITE, 'memory', span_name='result_write')
+    async def save(self, session_id, record):
+        stored = dict(record, outcomes=record['outcomes'].to_bytes())
+        self._records[session_id] = (time.time(), stored)
+
+    async def load(self, session_id):
+        entry = self._records.get(session_id)
+        if not entry or time.time() - entry[0] > self.retention_seconds:
+            return None
+        return dict(entry[1], outcomes=Outcomes.from_bytes(entry[1]['outcomes']))
+
+    async def purge_expired(self):
+        cutoff = time.time() - self.retention_seconds
+        expired = [sid for sid, (saved_at, _) in self._records.items() if saved_at < cutoff]
+        for sid in expired:
+            del self._records[sid]
+        return len(expired)
+
+class SQLiteResultStore(ResultStore):
+    """Stores records in a local SQLite file. All disk work happens in a worker thread."""
+
+    def __init__(self, path: str, retention_seconds: float):
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " session_id TEXT PRIMARY KEY, saved_at REAL NOT NULL, set_id TEXT NOT NULL,"
+                " bank_version TEXT NOT NULL, quiz_name TEXT NOT NULL, total_score INTEGER NOT NULL,"
+                " outcomes BLOB NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_saved_at ON results (saved_at)")
+            self._db.commit()
+
+    def _save(self, records):
+        saved_at = time.time()
+        rows = [(session_id, saved_at, record['set_id'], record['bank_version'], record['quiz_name'],
+                 record['total_score'], record['outcomes'].to_bytes())
+                for session_id, record in records.items()]
+        with self._lock:
+            # One transaction for the whole batch, however many players a group quiz had
+            self._db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+
+    def _load(self, session_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT set_id, bank_version, quiz_name, total_score, outcomes FROM results"
+                " WHERE session_id = ? AND saved_at >= ?",
+                (session_id, time.time() - self.retention_seconds),
+            ).fetchone()
+        if not row:
+            return None
+        set_id, bank_version, quiz_name, total_score, outcomes = row
+        return {'set_id': set_id, 'bank_version': bank_version, 'quiz_name': quiz_name,
+                'total_score': total_score, 'outcomes': Outcomes.from_bytes(outcomes)}
+
+    def _purge_expired(self):
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM results WHERE saved_at < ?", (time.time() - self.retention_seconds,))
+            self._db.commit()
+        return cursor.rowcount
+
+    @timed(RESULT_WRITE, 'sqlite', span_name='result_write')
+    async def save(self, session_id, record):
+        await asyncio.to_thread(self._save, {session_id: record})
+
+    @timed(RESULT_WRITE, 'sqlite', span_name='result_write')
+    async def save_many(self, records):
+        await asyncio.to_thread(self._save, records)
+
+    async def load(self, session_id):
+        return await asyncio.to_thread(self._load, session_id)
+
+    async def purge_expired(self):
+        return await asyncio.to_thread(self._purge_expired)
+
+def create_result_store() -> ResultStore:
+    """Picks the backend from the RESULT_STORE environment variable ('sqlite' or 'memory')."""
+    retention_seconds = RESULT_RETENTION_HOURS * 3600
+    if RESULT_STORE_BACKEND == "memory":
+        return MemoryResultStore(retention_seconds)
+    return SQLiteResultStore(RESULT_DB_PATH, retention_seconds)
+
+def __getattr__(name):
+    # RESULT_STORE is opened on first use, so importing Outcomes (e.g. to format a review) doesn't touch the database
+    if name == 'RESULT_STORE':
+        global RESULT_STORE
+        RESULT_STORE = create_result_store()
+        return RESULT_STORE
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
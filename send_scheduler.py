@@ -0,0 +1,258 @@
+# send_scheduler.py
+
+"""
+This module is the "Post Office". Every outgoing Bot API call that puts something
+in a chat goes through one SendScheduler, which keeps us under Telegram's limits:
+a global token bucket (~30 messages/s for the whole bot) and one per chat. Polls
+jump ahead of ordinary messages, cosmetic edits (like the countdown) go last and
+an edit that is replaced by a newer one before it was sent is simply dropped.
+When Telegram answers with RetryAfter anyway, the chat is paused and the call is
+retried automatically instead of failing the session.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from telegram.error import RetryAfter
+from metrics import TRACE_UPDATES, span
+
+# --- Priority lanes (lower runs first) ---
+PRIORITY_POLL = 0       # polls and the deletes that make room for them
+PRIORITY_MESSAGE = 1    # scores, reviews and other regular messages
+PRIORITY_COSMETIC = 2   # countdown edits and similar, safe to drop when superseded
+
+# Telegram's global limit is per bot, so sharded workers split it between them
+GLOBAL_RATE = float(os.environ.get("SEND_GLOBAL_RATE", "30")) / int(os.environ.get("WORKER_COUNT", "1"))
+PRIVATE_CHAT_RATE = float(os.environ.get("SEND_PRIVATE_CHAT_RATE", "1"))
+GROUP_CHAT_RATE = float(os.environ.get("SEND_GROUP_CHAT_RATE", str(20 / 60)))
+CHAT_BURST = float(os.environ.get("SEND_CHAT_BURST", "5"))
+MAX_RETRIES = 5
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`."""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float, cost: float = 1) -> float:
+        """Seconds until `cost` tokens are available (0 if they already are)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= cost else (cost - self.tokens) / self.rate
+
+    def take(self, cost: float = 1):
+        self.tokens -= cost
+
+class _Job:
+    __slots__ = ('factory', 'priority', 'cost', 'coalesce_key', 'future', 'retries')
+
+    def __init__(self, factory, priority, cost, coalesce_key, future):
+        self.factory = factory
+        self.priority = priority
+        self.cost = cost
+        self.coalesce_key = coalesce_key
+        self.future = future
+        self.retries = 0
+
+class _ChatQueue:
+    __slots__ = ('bucket', 'lanes', 'blocked_until', 'entry')
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self.lanes = (deque(), deque(), deque())
+        self.blocked_until = 0.0
+        self.entry = None  # seq of this chat's current heap entry; older entries are stale
+
+    def head(self):
+        """The next job to send (highest priority lane first), skipping dropped ones."""
+        for lane in self.lanes:
+            while lane and lane[0].future.done():
+                lane.popleft()
+            if lane:
+                return lane[0]
+        return None
+
+class SendScheduler:
+    """Queues Bot API calls per chat and releases them within the global and per-chat rate limits."""
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, private_rate: float = PRIVATE_CHAT_RATE,
+                 group_rate: float = GROUP_CHAT_RATE, chat_burst: float = CHAT_BURST):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self._chats = {}        # chat_id -> _ChatQueue
+        self._ready = []        # heap of (priority, seq, chat_id): chats that may send now
+        self._waiting = []      # heap of (ready_at, seq, chat_id): chats held back by their own limit
+        self._seq = itertools.count()
+        self._coalesced = {}    # coalesce_key -> queued _Job
+        self._wakeup = None
+        self._task = None
+        self._in_flight = set()
+        # Metrics
+        self.sent = 0
+        self.dropped = 0
+        self.flood_waits = 0
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def call(self, chat_id: int, factory, priority: int = PRIORITY_MESSAGE, cost: float = 1, coalesce_key=None, label: str = 'call'):
+        """
+        Schedules `await factory()` for `chat_id` and returns its result. `factory` must create a
+        fresh coroutine each time, since a call is re-run after a RetryAfter. `cost` is charged to
+        the chat's bucket (use 0 for calls that don't post anything, like deletes). If a newer call
+        with the same `coalesce_key` is queued before this one was sent, this one returns None.
+        `label` names the call in update traces.
+        """
+        self._ensure_running()
+        job = _Job(factory, priority, cost, coalesce_key, asyncio.get_running_loop().create_future())
+        if coalesce_key is not None:
+            superseded = self._coalesced.get(coalesce_key)
+            if superseded is not None and not superseded.future.done():
+                superseded.future.set_result(None)
+                self.dropped += 1
+            self._coalesced[coalesce_key] = job
+
+        chat = self._chat(chat_id)
+        chat.lanes[priority].append(job)
+        self._schedule(chat_id, chat)
+        if TRACE_UPDATES:
+            # Queueing included: this is how long the handler waited for the call
+            with span(f"send.{label}"):
+                return await job.future
+        return await job.future
+
+    def _chat(self, chat_id: int) -> _ChatQueue:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            # Negative ids are groups and channels, which Telegram limits much harder
+            chat = self._chats[chat_id] = _ChatQueue(self.private_rate if chat_id > 0 else self.group_rate, self.chat_burst)
+        return chat
+
+    def _schedule(self, chat_id: int, chat: _ChatQueue):
+        """
+        (Re)places the chat on the ready heap if its next job may go now, otherwise on the
+        waiting heap for when it may. A chat with nothing queued is put on the waiting heap
+        for when its bucket is full again, at which point its state is dropped.
+        """
+        now = time.monotonic()
+        head = chat.head()
+        chat.entry = seq = next(self._seq)
+        if head is None:
+            idle_at = max(chat.blocked_until, now + chat.bucket.wait_time(now, chat.bucket.burst))
+            heapq.heappush(self._waiting, (idle_at, seq, chat_id))
+            return
+        ready_at = max(chat.blocked_until, now + chat.bucket.wait_time(now, head.cost))
+        if ready_at <= now:
+            heapq.heappush(self._ready, (head.priority, seq, chat_id))
+        else:
+            heapq.heappush(self._waiting, (ready_at, seq, chat_id))
+        self._wakeup.set()
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, seq, chat_id = heapq.heappop(self._waiting)
+                chat = self._chats.get(chat_id)
+                if chat is None or chat.entry != seq:
+                    continue
+                if chat.head() is None:
+                    del self._chats[chat_id]
+                else:
+                    self._schedule(chat_id, chat)
+
+            if not self._ready:
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                self._wakeup.clear()
+                try: await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError: pass
+                continue
+
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            _, seq, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            if chat is None or chat.entry != seq:
+                continue
+            job = chat.head()
+            if job is not None:
+                chat.lanes[job.priority].popleft()
+                if job.coalesce_key is not None and self._coalesced.get(job.coalesce_key) is job:
+                    del self._coalesced[job.coalesce_key]
+                self.global_bucket.take()
+                chat.bucket.take(job.cost)
+                task = asyncio.get_running_loop().create_task(self._run(chat_id, job))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+            self._schedule(chat_id, chat)
+
+    async def _run(self, chat_id: int, job: _Job):
+        try:
+            result = await job.factory()
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            retry_after = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+            self.flood_waits += 1
+            job.retries += 1
+            if job.retries > MAX_RETRIES:
+                if not job.future.done(): job.future.set_exception(e)
+                return
+            logging.warning(f"Flood control in chat {chat_id}: pausing it for {retry_after}s.")
+            chat = self._chat(chat_id)
+            chat.blocked_until = max(chat.blocked_until, time.monotonic() + retry_after)
+            chat.lanes[job.priority].appendleft(job)
+            self._schedule(chat_id, chat)
+            return
+        except Exception as e:
+            if not job.future.done(): job.future.set_exception(e)
+            return
+        self.sent += 1
+        if not job.future.done(): job.future.set_result(result)
+
+    # --- Convenience wrappers for the calls the bot makes ---
+
+    async def send_message(self, bot, chat_id: int, text: str, priority: int = PRIORITY_MESSAGE, **kwargs):
+        return await self.call(chat_id, lambda: bot.send_message(chat_id, text=text, **kwargs), priority, label='sendMessage')
+
+    async def send_poll(self, bot, chat_id: int, **kwargs):
+        return await self.call(chat_id, lambda: bot.send_poll(chat_id=chat_id, **kwargs), PRIORITY_POLL, label='sendPoll')
+
+    async def edit_message_text(self, bot, chat_id: int, message_id: int, text: str, priority: int = PRIORITY_COSMETIC, **kwargs):
+        """Edits are coalesced per message: only the newest queued text is sent."""
+        return await self.call(
+            chat_id, lambda: bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs),
+            priority, coalesce_key=('edit', chat_id, message_id), label='editMessageText',
+        )
+
+    async def delete_message(self, bot, chat_id: int, message_id: int, priority: int = PRIORITY_POLL):
+        return await self.call(chat_id, lambda: bot.delete_message(chat_id, message_id), priority, cost=0, label='deleteMessage')
+
+    def stats(self) -> dict:
+        return {
+            'queued_chats': len(self._chats),
+            'in_flight': len(self._in_flight),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'flood_waits': self.flood_waits,
+        }
+
+# One shared scheduler for the whole bot
+SENDER = SendScheduler()
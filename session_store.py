@@ -0,0 +1,137 @@
+# session_store.py
+
+"""
+This module is the "Save Game". It keeps the serialized state of every running
+QuizSession outside the process, so a restarted (or another) worker can pick a
+quiz up where it stopped, and so the router can tell which chat a poll belongs to.
+
+Stores are plain key/value stores with string keys and JSON values, the same
+shape as Redis: 'session:<chat_id>' holds a session's state and 'poll:<poll_id>'
+holds the chat id that owns a poll.
+"""
+
+import asyncio
+import json
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+
+SESSION_STORE_BACKEND = os.environ.get("SESSION_STORE", "memory")
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.db")
+
+class SessionStore(ABC):
+    """
+    Base class for session stores. Backends only implement the four key/value
+    primitives below; everything else is built on top of them.
+    """
+    # Whether other processes (or this one after a restart) can read what is stored.
+    # Sessions don't bother saving their state into a store that can't.
+    shared = True
+
+    @abstractmethod
+    async def _get(self, key: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _set(self, key: str, value: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _scan(self, prefix: str) -> list:
+        """Returns the values of all keys starting with `prefix`."""
+        raise NotImplementedError
+
+    async def save(self, chat_id: int, state: dict) -> None:
+        await self._set(f"session:{chat_id}", json.dumps(state, separators=(',', ':')))
+
+    async def load(self, chat_id: int):
+        value = await self._get(f"session:{chat_id}")
+        return json.loads(value) if value else None
+
+    async def delete(self, chat_id: int) -> None:
+        await self._delete(f"session:{chat_id}")
+
+    async def load_all(self) -> list:
+        return [json.loads(value) for value in await self._scan("session:")]
+
+    async def map_poll(self, poll_id: str, chat_id: int) -> None:
+        await self._set(f"poll:{poll_id}", str(chat_id))
+
+    async def unmap_poll(self, poll_id: str) -> None:
+        await self._delete(f"poll:{poll_id}")
+
+    async def poll_owner(self, poll_id: str):
+        """The chat id a poll was sent to, or None."""
+        value = await self._get(f"poll:{poll_id}")
+        return int(value) if value else None
+
+class MemorySessionStore(SessionStore):
+    """Keeps everything in a dict. Fine for a single process; nothing survives a restart."""
+    shared = False
+
+    def __init__(self):
+        self._data = {}
+
+    async def _get(self, key):
+        return self._data.get(key)
+
+    async def _set(self, key, value):
+        self._data[key] = value
+
+    async def _delete(self, key):
+        self._data.pop(key, None)
+
+    async def _scan(self, prefix):
+        return [value for key, value in self._data.items() if key.startswith(prefix)]
+
+class SQLiteSessionStore(SessionStore):
+    """
+    A local stand-in for Redis: one key/value table in a SQLite file (WAL mode), which
+    several worker processes on the same machine can share. Disk work runs in a worker thread.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.commit()
+
+    def _run(self, sql, params=(), fetch=None):
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+            if fetch == 'one':
+                return cursor.fetchone()
+            if fetch == 'all':
+                return cursor.fetchall()
+            self._db.commit()
+
+    async def _get(self, key):
+        row = await asyncio.to_thread(self._run, "SELECT value FROM kv WHERE key = ?", (key,), 'one')
+        return row[0] if row else None
+
+    async def _set(self, key, value):
+        await asyncio.to_thread(self._run, "INSERT OR REPLACE INTO kv VALUES (?, ?)", (key, value))
+
+    async def _delete(self, key):
+        await asyncio.to_thread(self._run, "DELETE FROM kv WHERE key = ?", (key,))
+
+    async def _scan(self, prefix):
+        # Range scan on the primary key instead of LIKE, so the index is used
+        rows = await asyncio.to_thread(self._run, "SELECT value FROM kv WHERE key >= ? AND key < ?", (prefix, prefix + '\uffff'), 'all')
+        return [row[0] for row in rows]
+
+def create_session_store() -> SessionStore:
+    """Picks the backend from the SESSION_STORE environment variable ('memory' or 'sqlite')."""
+    if SESSION_STORE_BACKEND == "sqlite":
+        return SQLiteSessionStore(SESSION_DB_PATH)
+    return MemorySessionStore()
+
+SESSION_STORE = create_session_store()
@@ -0,0 +1,113 @@
+# sharding.py
+
+"""
+This module is the "Dispatcher" for running the bot as several processes.
+
+One router process receives every update from Telegram (by polling or webhook)
+and forwards it over HTTP to the worker process that owns the chat. Chats are
+split between workers by `chat_id % WORKER_COUNT`. Poll answers carry no chat,
+so the router asks the shared session store which chat the poll was sent to.
+Each worker runs the normal handlers for its own chats only.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import httpx
+from telegram import Update
+
+WORKER_COUNT = int(os.environ.get("WORKER_COUNT", "1"))
+WORKER_INDEX = int(os.environ.get("WORKER_INDEX", "0"))
+# Where the router sends each shard's updates, in shard order, e.g. "http://127.0.0.1:9001,http://127.0.0.1:9002"
+WORKER_URLS = [u.strip() for u in os.environ.get("WORKER_URLS", "").split(",") if u.strip()]
+WORKER_PORT = int(os.environ.get("WORKER_PORT", "9001"))
+# Workers only listen on loopback unless told otherwise; any other address needs SHARD_SECRET
+WORKER_HOST = os.environ.get("WORKER_HOST", "127.0.0.1")
+# Shared secret the router sends and workers check, so only the router can push updates
+SHARD_SECRET = os.environ.get("SHARD_SECRET", "")
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+def shard_for(chat_id: int) -> int:
+    return chat_id % WORKER_COUNT
+
+def owns_chat(chat_id: int) -> bool:
+    """Whether this process is responsible for `chat_id`."""
+    return shard_for(chat_id) == WORKER_INDEX
+
+async def route_key(update: Update, session_store):
+    """The chat id an update should be routed by."""
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.poll_answer:
+        owner = await session_store.poll_owner(update.poll_answer.poll_id)
+        if owner is not None:
+            return owner
+        # In private chats the user id is the chat id
+        return update.poll_answer.user.id if update.poll_answer.user else None
+    return update.effective_user.id if update.effective_user else None
+
+class UpdateForwarder:
+    """Router side: POSTs updates to the worker that owns their chat, over kept-alive connections."""
+
+    def __init__(self, worker_urls: list, session_store):
+        if len(worker_urls) != WORKER_COUNT:
+            raise ValueError(f"WORKER_URLS has {len(worker_urls)} entries but WORKER_COUNT is {WORKER_COUNT}.")
+        self.worker_urls = worker_urls
+        self.session_store = session_store
+        self._client = httpx.AsyncClient(timeout=10, headers={"X-Shard-Secret": SHARD_SECRET})
+
+    async def forward(self, update: Update):
+        key = await route_key(update, self.session_store)
+        if key is None:
+            return
+        response = await self._client.post(self.worker_urls[shard_for(key)], json=update.to_dict())
+        response.raise_for_status()
+
+    async def close(self):
+        await self._client.aclose()
+
+async def serve_updates(application, host: str = WORKER_HOST, port: int = WORKER_PORT):
+    """
+    Worker side: a tiny HTTP/1.1 server that accepts updates from the router and puts
+    them on the application's update queue. Returns the asyncio server.
+    """
+    # Without a secret, anyone who can reach the port could push forged updates (e.g. admin commands)
+    if not SHARD_SECRET and host not in LOOPBACK_HOSTS:
+        raise ValueError(f"SHARD_SECRET must be set for a worker listening on {host}.")
+    expected_secret = SHARD_SECRET.encode()
+
+    async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+
+                if not hmac.compare_digest(headers.get("x-shard-secret", "").encode("latin-1"), expected_secret):
+                    status = "403 Forbidden"
+                else:
+                    try:
+                        update = Update.de_json(json.loads(body), application.bot)
+                        await application.update_queue.put(update)
+                        status = "200 OK"
+                    except (ValueError, KeyError, TypeError) as e:
+                        logging.warning(f"Rejected a forwarded update: {e}")
+                        status = "400 Bad Request"
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_connection, host, port)
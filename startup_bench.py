@@ -0,0 +1,126 @@
+# startup_bench.py
+
+"""
+This module is the "Stopwatch". It measures how long a freshly started bot process
+takes to answer its first update, the number that matters when instances are
+started on demand (e.g. Render scaling up). Each run is a new Python process,
+so every import really is cold:
+
+    process start -> imports -> build_application -> start (post_init) -> /start answered
+
+The bot talks to the fakes in fake_services.py, so nothing leaves the machine.
+Supabase is the real client built by quiz_manager (connection pool included),
+pointed at a local FakePostgrest; how long building it takes is reported as
+"supabase_client", which overlaps start and first_reply. post_init is awaited
+right after start(), as run_polling does.
+
+Example:
+    python startup_bench.py --runs 10 --sets 200 --db-latency 0.1
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+PHASES = ('interpreter', 'imports', 'build', 'start', 'first_reply', 'total', 'supabase_client')
+
+def child(args):
+    """One cold start. Prints the phase timings (seconds) as a JSON line."""
+    spawned = float(os.environ['STARTUP_BENCH_SPAWNED'])
+    started = time.time()
+    # Keep everything in memory, like the load test
+    os.environ.setdefault("RESULT_STORE", "memory")
+    os.environ.setdefault("SESSION_STORE", "memory")
+    os.environ.setdefault("QUIZ_SNAPSHOT_PATH", "")
+    os.environ.setdefault("ANALYTICS_DB_PATH", ":memory:")
+
+    import asyncio
+    import bot
+    import quiz_manager
+    from fake_services import FakeBotAPI, FakePostgrest, make_quizzes_table, command_update
+    imported = time.time()
+
+    postgrest = FakePostgrest({'quizzes': make_quizzes_table(args.sets, args.questions)}, latency=args.db_latency)
+    quiz_manager.url, quiz_manager.key = postgrest.url, "startup-bench-key"
+    client_built = []
+    create_supabase = quiz_manager._create_supabase
+
+    def timed_create_supabase():
+        t = time.time()
+        client = create_supabase()
+        client_built.append(time.time() - t)
+        return client
+    quiz_manager._create_supabase = timed_create_supabase
+    api = FakeBotAPI(latency=args.api_latency)
+    application = bot.build_application("123456:STARTUP-BENCH", role="standalone", request=api)
+    built = time.time()
+
+    async def run():
+        from telegram import Update
+        chat_id = 1_000_000
+        replied = asyncio.get_running_loop().create_future()
+
+        def on_api_call(method, params, result):
+            if method == 'sendMessage' and int(params.get('chat_id', 0)) == chat_id and not replied.done():
+                replied.set_result(time.time())
+        api.listener = on_api_call
+
+        async with application:
+            await application.start()
+            await application.post_init(application)
+            running = time.time()
+            await application.update_queue.put(Update.de_json(command_update(chat_id, chat_id, '/start'), application.bot))
+            first_reply = await asyncio.wait_for(replied, args.timeout)
+            await application.stop()
+        await application.post_shutdown(application)
+        return running, first_reply
+
+    running, first_reply = asyncio.run(run())
+    postgrest.close()
+    print(json.dumps({
+        'interpreter': started - spawned, 'imports': imported - started, 'build': built - imported,
+        'start': running - built, 'first_reply': first_reply - running, 'total': first_reply - spawned,
+        'supabase_client': client_built[0] if client_built else 0.0,
+    }))
+
+def percentile(samples: list, point: int) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the bot's time from process start to its first answered update.")
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts")
+    parser.add_argument("--sets", type=int, default=50, help="quiz sets in the fake Supabase")
+    parser.add_argument("--questions", type=int, default=10, help="questions per set")
+    parser.add_argument("--db-latency", type=float, default=0.05, help="seconds added to every fake Supabase query")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="seconds added to every fake Bot API call")
+    parser.add_argument("--timeout", type=float, default=30, help="give up on a run after this many seconds")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    results = []
+    for run in range(args.runs):
+        env = dict(os.environ, STARTUP_BENCH_SPAWNED=repr(time.time()))
+        completed = subprocess.run([sys.executable, __file__, "--child"] + sys.argv[1:], env=env,
+                                   capture_output=True, text=True, timeout=args.timeout + 30)
+        lines = [line for line in completed.stdout.splitlines() if line.startswith('{')]
+        if completed.returncode != 0 or not lines:
+            print(f"Run {run + 1} failed:\n{completed.stderr[-2000:]}")
+            continue
+        results.append(json.loads(lines[-1]))
+        print(f"Run {run + 1}: " + "  ".join(f"{phase} {results[-1][phase] * 1000:.0f}ms" for phase in PHASES))
+
+    if results:
+        print(f"\n=== Startup: {len(results)} cold starts, {args.sets} sets, db latency {args.db_latency}s ===")
+        for phase in PHASES:
+            samples = [result[phase] for result in results]
+            print(f"{phase:<15}: p50={percentile(samples, 50) * 1000:.0f}ms max={max(samples) * 1000:.0f}ms")
+
+if __name__ == '__main__':
+    main()
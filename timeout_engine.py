@@ -0,0 +1,107 @@
+# timeout_engine.py
+
+"""
+This module is the "Referee's Stopwatch". It runs the per-question timeouts on a
+hashed timer wheel: arming and cancelling a timeout are O(1) dict operations
+keyed by poll id, no matter how many quizzes are running at the same time.
+"""
+
+import asyncio
+import logging
+import math
+from metrics import METRICS_ENABLED, TIMER_LAG
+
+class TimeoutEngine:
+    """
+    A hashed timer wheel. Time is cut into ticks of `tick` seconds; each timeout
+    lives in the slot for the tick it is due on. One background task walks the
+    wheel and fires everything that is due. If the loop was busy and the task
+    woke up late, it catches up on every missed tick, so nothing is skipped.
+    """
+
+    def __init__(self, tick: float = 0.1, slots: int = 512):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]
+        self._where = {}  # key -> slot index, for O(1) cancel
+        self._current_tick = 0
+        self._started_at = None
+        self._task = None
+        self._running_callbacks = set()
+        # Metrics
+        self.fired = 0
+        self.cancelled = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def __len__(self):
+        return len(self._where)
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            loop = asyncio.get_running_loop()
+            self._started_at = loop.time()
+            self._current_tick = 0
+            self._task = loop.create_task(self._run())
+
+    def arm(self, key, delay: float, callback, *args):
+        """Calls `await callback(*args)` after `delay` seconds, unless cancelled first. Re-arming a key replaces it."""
+        self._ensure_running()
+        self.cancel(key, count=False)
+        deadline = asyncio.get_running_loop().time() + delay
+        due_tick = max(self._current_tick + 1, math.ceil((deadline - self._started_at) / self.tick))
+        slot = due_tick % len(self._slots)
+        self._slots[slot][key] = (due_tick, deadline, callback, args)
+        self._where[key] = slot
+
+    def cancel(self, key, count: bool = True) -> bool:
+        """Disarms a timeout. Returns False if it wasn't armed (already fired or never set)."""
+        slot = self._where.pop(key, None)
+        if slot is None:
+            return False
+        del self._slots[slot][key]
+        if count:
+            self.cancelled += 1
+        return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            next_tick_at = self._started_at + (self._current_tick + 1) * self.tick
+            await asyncio.sleep(max(0.0, next_tick_at - loop.time()))
+            now = loop.time()
+            while self._started_at + (self._current_tick + 1) * self.tick <= now:
+                self._current_tick += 1
+                self._fire_due(self._slots[self._current_tick % len(self._slots)], now)
+
+    def _fire_due(self, slot: dict, now: float):
+        # Entries for later laps around the wheel share this slot; leave those alone
+        due = [key for key, entry in slot.items() if entry[0] <= self._current_tick]
+        for key in due:
+            _, deadline, callback, args = slot.pop(key)
+            del self._where[key]
+            lag = max(0.0, now - deadline)
+            self.fired += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            if METRICS_ENABLED: TIMER_LAG.observe(lag)
+            task = asyncio.get_running_loop().create_task(self._call(key, callback, args))
+            self._running_callbacks.add(task)
+            task.add_done_callback(self._running_callbacks.discard)
+
+    async def _call(self, key, callback, args):
+        try:
+            await callback(*args)
+        except Exception:
+            logging.exception(f"Timeout callback for {key} failed.")
+
+    def stats(self) -> dict:
+        return {
+            'armed': len(self._where),
+            'fired': self.fired,
+            'cancelled': self.cancelled,
+            'lag_avg': self.lag_total / self.fired if self.fired else 0.0,
+            'lag_max': self.lag_max,
+        }
+
+# One shared engine for every quiz session in this process
+TIMEOUTS = TimeoutEngine()
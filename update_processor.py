@@ -0,0 +1,111 @@
+# update_processor.py
+
+"""
+This module is the "Traffic Controller". It lets the Application handle many
+updates at once, while updates that belong to the same chat still run one after
+another in the order they arrived. A slow chat only ever waits on itself.
+"""
+
+import asyncio
+import contextvars
+import time
+from collections import deque
+from telegram.ext import BaseUpdateProcessor
+from metrics import METRICS_ENABLED, TRACE_UPDATES, UPDATE_LATENCY, span, start_trace, finish_trace
+
+# What PerChatUpdateProcessor hands PTB as its limit: waiting updates must not hold a slot
+UNLIMITED_UPDATES = 1_000_000
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Runs updates concurrently (up to `max_concurrent_updates`), serialized per chat.
+    `chat_key(update)` returns the key to serialize on, or None for updates that
+    don't need ordering.
+
+    Updates waiting for their chat sit in that chat's queue, drained by one task per
+    busy chat; only the update actually running holds one of the concurrency slots,
+    so a chat with a long backlog can't starve the others. PTB's own limit (taken
+    before do_process_update, i.e. while still waiting for the chat) is therefore
+    set out of reach, and the real one is `slots`, taken only to run an update.
+    """
+
+    def __init__(self, max_concurrent_updates: int, chat_key):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(UNLIMITED_UPDATES)
+        self.limit = max_concurrent_updates
+        self.slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chat_key = chat_key
+        self._queues = {}  # key -> deque of (coroutine, context, future, wait span) for that chat
+        self._drainers = set()  # strong references to the running drain tasks
+
+    async def do_process_update(self, update, coroutine) -> None:
+        if METRICS_ENABLED:
+            await self._measured(update, coroutine)
+        else:
+            await self._dispatch(update, coroutine)
+
+    async def _measured(self, update, coroutine) -> None:
+        started = time.perf_counter()
+        trace = start_trace() if TRACE_UPDATES else None
+        try:
+            await self._dispatch(update, coroutine)
+        finally:
+            elapsed = time.perf_counter() - started
+            UPDATE_LATENCY.observe(elapsed)
+            if trace is not None:
+                finish_trace(trace, getattr(update, 'update_id', None), self._chat_key(update), elapsed)
+
+    async def _dispatch(self, update, coroutine) -> None:
+        key = self._chat_key(update)
+        if key is None:
+            async with self.slots:
+                await coroutine
+            return
+
+        # The update runs in its own copy of this context, so its trace spans still land in its own trace
+        waiting = span("chat_wait").__enter__() if TRACE_UPDATES else None
+        done = asyncio.get_running_loop().create_future()
+        job = (coroutine, contextvars.copy_context(), done, waiting)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque([job])
+            drainer = asyncio.get_running_loop().create_task(self._drain(key, queue))
+            self._drainers.add(drainer)
+            drainer.add_done_callback(self._drainers.discard)
+        else:
+            queue.append(job)
+        await done
+
+    async def _drain(self, key, queue: deque) -> None:
+        """Runs one chat's updates in order until its queue is empty, then drops the queue."""
+        try:
+            while queue:
+                coroutine, context, done, waiting = queue[0]
+                if done.done():
+                    coroutine.close()  # abandoned while waiting, e.g. at shutdown
+                else:
+                    try:
+                        await asyncio.get_running_loop().create_task(self._run(coroutine, waiting), context=context)
+                    except Exception as e:
+                        if not done.done(): done.set_exception(e)
+                    else:
+                        if not done.done(): done.set_result(None)
+                queue.popleft()
+        finally:
+            for coroutine, _, done, _ in queue:
+                coroutine.close()
+                done.cancel()
+            del self._queues[key]
+
+    async def _run(self, coroutine, waiting) -> None:
+        async with self.slots:
+            if waiting is not None:
+                waiting.__exit__(None, None, None)
+            await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
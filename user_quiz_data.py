@@ -4,62 +4,127 @@
 This module is the "Artist". It takes raw quiz result data
 and formats it into the beautiful, user-facing "Detailed Review" message.
 It handles all the special fonts, symbols, HTML tags, and message splitting.
+
+Reviews are rendered one page at a time, only when a page is asked for, and
+rendered pages are kept in a small per-session cache so flipping back and forth
+costs nothing.
 """
 
+import os
+from collections import OrderedDict
 from html import escape
+from question_bank import QuestionBank
+from result_store import Outcomes, STATUSES
+
+# Telegram counts message length in UTF-16 code units, not Python characters.
+# Pages stay a little under the 4096 limit, since our count includes the HTML tags.
+PAGE_BUDGET = 3900
+REVIEW_CACHE_SIZE = int(os.environ.get("REVIEW_CACHE_SIZE", "256"))
+
+def utf16_len(text: str) -> int:
+    """Length as Telegram measures it: characters outside the BMP (like 𝐐 or emoji) count twice."""
+    return len(text.encode('utf-16-le')) // 2
+
+def format_question_review(number: int, outcomes: Outcomes, i: int, bank: QuestionBank):
+    """The review block for the i-th outcome, shown as question `number`. None if the question is gone."""
+    index = outcomes.question_index[i]
+    if not 0 <= index < len(bank):
+        return None
+    try:
+        question = bank[index]
+    except KeyError:
+        return None  # a large set's row that has since been deleted
 
-def get_question_by_id_from_data(qid, questions_data):
-    """Helper to find a specific question from the question list."""
-    return next((q for q in questions_data if q["id"] == qid), None)
+    # The bank keeps pre-escaped copies of all user-facing text to prevent HTML errors
+    answered = outcomes.answered_option_id[i]
+    options_lines = []
+    for j, option in enumerate(question.html_options):
+        label = ""
+        if j == answered and j == question.correct_option_id:
+            label = "  ◅◅  <i>Your Answer (Correct)</i>"
+        elif j == answered:
+            label = "  ◅◅  <i>Your Answer</i>"
+        elif j == question.correct_option_id:
+            label = "  ◅◅  <i>Correct Answer</i>"
+        options_lines.append(f"   ›  {option}{label}\n")
 
-def format_detailed_review(results: list, quiz_name: str, questions_data: list) -> list:
+    points, time_taken = outcomes.points[i], outcomes.time_taken[i]
+    status_map = {
+        'correct': f"Sᴛᴀᴛᴜs: Cᴏʀʀᴇᴄᴛ ║ Pᴏɪɴᴛs: +{points} ║ Tɪᴍᴇ: {time_taken:.1f}s",
+        'wrong': f"Sᴛᴀᴛᴜs: Wʀᴏɴɢ ║ Pᴏɪɴᴛs: {points} ║ Tɪᴍᴇ: {time_taken:.1f}s",
+        'skipped': "Sᴛᴀᴛᴜs: Sᴋɪᴘᴘᴇᴅ ║ Pᴏɪɴᴛs: +0 ║ Tɪᴍᴇ: ---",
+        'timed_out': "Sᴛᴀᴛᴜs: Tɪᴍᴇ's Uᴘ ║ Pᴏɪɴᴛs: +0 ║ Tɪᴍᴇ: ---",
+        'stopped': "Sᴛᴀᴛᴜs: Sᴛᴏᴘᴘᴇᴅ ║ Pᴏɪɴᴛs: +0 ║ Tɪᴍᴇ: ---"
+    }
+    result_text = status_map.get(STATUSES[outcomes.status[i]], "Sᴛᴀᴛᴜs: Uɴᴋɴᴏᴡɴ")
+
+    return (
+        "____________________________________\n\n"
+        f"❰ <b>𝐐𝐮𝐞𝐬𝐭𝐢𝐨𝐧 {number}</b> ❱\n{question.html_text}\n\n"
+        f"{''.join(options_lines)}\n↳  {result_text}\n\n"
+    )
+
+class ReviewPages:
     """
-    Takes quiz results and returns a list of formatted message strings,
-    split to respect Telegram's message length limits.
+    The "Detailed Review" of one finished quiz, split into pages that each fit in one
+    Telegram message. Pages are rendered lazily, in order, the first time they are needed.
     """
-    message_chunks = []
-    current_chunk = f"📝 ║  <b>𝐃𝐄𝐓𝐀𝐈𝐋𝐄𝐃 𝐑𝐄𝐕𝐈𝐄𝐖 » {escape(quiz_name)}</b>  ║ 📝\n\n"
-    
-    for i, result in enumerate(results):
-        question_data = get_question_by_id_from_data(result['question_id'], questions_data)
-        if not question_data:
-            continue
-
-        # Escape all user-facing text to prevent HTML errors
-        escaped_question = escape(question_data['question'])
-        escaped_options = [escape(opt) for opt in question_data['options']]
-        
-        options_text = ""
-        for j, option in enumerate(escaped_options):
-            label = ""
-            if j == result.get('answered_option_id') and j == question_data['correct_option_id']:
-                label = "  ◅◅  <i>Your Answer (Correct)</i>"
-            elif j == result.get('answered_option_id'):
-                label = "  ◅◅  <i>Your Answer</i>"
-            elif j == question_data['correct_option_id']:
-                label = "  ◅◅  <i>Correct Answer</i>"
-            options_text += f"   ›  {option}{label}\n"
-
-        status_map = {
-            'correct': f"Sᴛᴀᴛᴜs: Cᴏʀʀᴇᴄᴛ ║ Pᴏɪɴᴛs: +{result['points_earned']} ║ Tɪᴍᴇ: {result['time_taken']:.1f}s",
-            'wrong': f"Sᴛᴀᴛᴜs: Wʀᴏɴɢ ║ Pᴏɪɴᴛs: {result['points_earned']} ║ Tɪᴍᴇ: {result['time_taken']:.1f}s",
-            'skipped': "Sᴛᴀᴛᴜs: Sᴋɪᴘᴘᴇᴅ ║ Pᴏɪɴᴛs: +0 ║ Tɪᴍᴇ: ---",
-            'timed_out': "Sᴛᴀᴛᴜs: Tɪᴍᴇ's Uᴘ ║ Pᴏɪɴᴛs: +0 ║ Tɪᴍᴇ: ---",
-            'stopped': "Sᴛᴀᴛᴜs: Sᴛᴏᴘᴘᴇᴅ ║ Pᴏɪɴᴛs: +0 ║ Tɪᴍᴇ: ---"
-        }
-        result_text = status_map.get(result['status'], "Sᴛᴀᴛᴜs: Uɴᴋɴᴏᴡɴ")
-
-        question_review = (
-            "____________________________________\n\n"
-            f"❰ <b>𝐐𝐮𝐞𝐬𝐭𝐢𝐨𝐧 {i+1}</b> ❱\n{escaped_question}\n\n"
-            f"{options_text}\n↳  {result_text}\n\n"
-        )
-        
-        # Split message if it gets too long for Telegram
-        if len(current_chunk) + len(question_review) > 4000:
-            message_chunks.append(current_chunk)
-            current_chunk = ""
-        current_chunk += question_review
-
-    message_chunks.append(current_chunk)
-    return message_chunks
+    __slots__ = ('outcomes', 'quiz_name', 'bank', 'page_starts', 'pages')
+
+    def __init__(self, outcomes: Outcomes, quiz_name: str, bank: QuestionBank):
+        self.outcomes = outcomes
+        self.quiz_name = quiz_name
+        self.bank = bank
+        self.page_starts = [0]  # outcome index each known page starts at; one extra entry = end of the last rendered page
+        self.pages = []         # rendered page texts
+
+    def _header(self, page: int) -> str:
+        title = f"📝 ║  <b>𝐃𝐄𝐓𝐀𝐈𝐋𝐄𝐃 𝐑𝐄𝐕𝐈𝐄𝐖 » {escape(self.quiz_name)}</b>  ║ 📝\n"
+        return title + ("\n" if page == 0 else f"<i>Page {page + 1}</i>\n\n")
+
+    def _render_next(self):
+        """Renders the page after the last rendered one, filling it up to PAGE_BUDGET."""
+        page = len(self.pages)
+        header = self._header(page)
+        parts = [header]
+        used = utf16_len(header)
+        i = self.page_starts[page]
+        while i < len(self.outcomes):
+            block = format_question_review(i + 1, self.outcomes, i, self.bank)
+            if block is not None:
+                size = utf16_len(block)
+                # Always put at least one question on a page, so we can't get stuck
+                if used + size > PAGE_BUDGET and len(parts) > 1:
+                    break
+                parts.append(block)
+                used += size
+            i += 1
+        self.pages.append(''.join(parts))
+        self.page_starts.append(i)
+
+    def page(self, page: int):
+        """Returns (page number, text, has_previous, has_next). Out-of-range page numbers give the first page."""
+        if not self.pages:
+            self._render_next()
+        while len(self.pages) <= page and self.page_starts[-1] < len(self.outcomes):
+            self._render_next()
+        if not 0 <= page < len(self.pages):
+            page = 0
+        has_next = self.page_starts[page + 1] < len(self.outcomes)
+        return page, self.pages[page], page > 0, has_next
+
+# session_id -> ReviewPages, least recently viewed first
+REVIEW_CACHE = OrderedDict()
+
+def get_cached_review(session_id: str):
+    review = REVIEW_CACHE.get(session_id)
+    if review is not None:
+        REVIEW_CACHE.move_to_end(session_id)
+    return review
+
+def cache_review(session_id: str, review: ReviewPages) -> ReviewPages:
+    REVIEW_CACHE[session_id] = review
+    REVIEW_CACHE.move_to_end(session_id)
+    while len(REVIEW_CACHE) > REVIEW_CACHE_SIZE:
+        REVIEW_CACHE.popitem(last=False)
+    return review